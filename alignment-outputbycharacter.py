@@ -1,5 +1,9 @@
-import sys, re, pandas
-import codecs
+import argparse, re
+import keystroke_reader
+import needleman_wunsch
+import output_writer
+import parallel_alignment
+import profiling
 
 
 class ErrorAligner:
@@ -11,18 +15,31 @@ class ErrorAligner:
       Should Intended character aligned to nothing in the typed be ignored? - assumed to be an omission and thus ignored (justification - we are interested in errors of commission not errors of omission).
     """
 
-    def __init__(self, input_file, output_file, language="english"):
+    def __init__(self, input_file, output_file, language="english", engine="python", input_format=None,
+                 buffer_size=output_writer.DEFAULT_BUFFER_SIZE, compression=None, workers=1):
         """
         Constructor.
         :param
             output_file: file name to write aligned errors to.
+            engine: alignment engine from needleman_wunsch.ENGINES ('python', 'numpy' or 'banded').
+            input_format: one of keystroke_reader.FORMATS, guessed from the file extension if None.
+            buffer_size: size in bytes of the write buffer of the output file.
+            compression: None, 'gzip' or 'zstd'; guessed from the output file extension if None.
+            workers: number of processes that align sentences; the output is the same for any number.
         """
         self.idmap = None
         if language.lower() == "english":
             self.idmap = self.create_idmap()
         self.input_file = input_file
+        self.input_format = input_format
         self.output_file = output_file
-        self.gap_penalty = -2  # both for insertion and deletion
+        self.out = None  # OutputWriter, open while parse_errors runs
+        self.buffer_size = buffer_size
+        self.compression = compression
+        self.workers = workers
+        self.gap_penalty = needleman_wunsch.GAP_PENALTY  # both for insertion and deletion
+        needleman_wunsch.get_engine(engine)
+        self.engine = engine
 
     def create_idmap(self):
         idmap = {'143': '1a', '144': '2a', '145': '2b', '146': '1b', '148': '3', '149': '4a', '150': '5a', '151': '5b',
@@ -75,9 +92,8 @@ class ErrorAligner:
                 toprint = toprint + errorfreeword
                 toprint = toprint + u"\"\t\""
                 toprint = toprint + unicode(times[m2]) + u"\"\n"
-                with codecs.open(self.output_file, 'ab', 'utf-8') as out:
-                    out.write(toprint)
-                    m2+=1
+                self.out.write(toprint)
+                m2+=1
             if align1[m1] == "}":
                 errorfreeword = u"1"
                    
@@ -88,67 +104,37 @@ class ErrorAligner:
 
         
         
-    # The function needle is adapted from the following :
-    # https://github.com/alevchuk/pairwise-alignment-in-python
-    def needle(self, seq1, seq2, itempartid, times):
-        m, n = len(seq1), len(seq2)  # length of two sequences
-
-        # Generate DP table and traceback path pointer matrix
-        score = zeros((m + 1, n + 1))  # the DP table
-
-        # Calculate DP table
-        for i in range(0, m + 1):
-            score[i][0] = self.gap_penalty * i
-        for j in range(0, n + 1):
-            score[0][j] = self.gap_penalty * j
-        for i in range(1, m + 1):
-            for j in range(1, n + 1):
-                match = score[i - 1][j - 1] + self.match_score(seq1[i - 1], seq2[j - 1])
-                delete = score[i - 1][j] + self.gap_penalty
-                insert = score[i][j - 1] + self.gap_penalty
-                score[i][j] = max(match, delete, insert)
-
-        # Traceback and compute the alignment
-        align1, align2 = '', ''
-        i, j = m, n  # start from the bottom right cell
-        while i > 0 and j > 0:  # end touching the top or the left edge
-            score_current = score[i][j]
-            score_diagonal = score[i - 1][j - 1]
-            score_up = score[i][j - 1]
-            score_left = score[i - 1][j]
-
-            if score_current == score_diagonal + self.match_score(seq1[i - 1], seq2[j - 1]):
-                align1 += seq1[i - 1]
-                align2 += seq2[j - 1]
-                i -= 1
-                j -= 1
-            elif score_current == score_left + self.gap_penalty:
-                align1 += seq1[i - 1]
-                align2 += '^'
-                i -= 1
-            elif score_current == score_up + self.gap_penalty:
-                align1 += '^'
-                align2 += seq2[j - 1]
-                j -= 1
+    def __getstate__(self):
+        # the output stream stays in the parent process when aligning in parallel
+        state = self.__dict__.copy()
+        state['out'] = None
+        return state
 
-        # Finish tracing up to the top left cell
-        while i > 0:
-            align1 += seq1[i - 1]
-            align2 += '^'
-            i -= 1
-        while j > 0:
-            align1 += '^'
-            align2 += seq2[j - 1]
-            j -= 1
-
-        self.outputforanalysis(align1, align2, seq2, itempartid, times, seq1)
+    def needle(self, seq1, seq2, itempartid, times):
+        with profiling.section('align', len(seq1)):
+            align1, align2 = needleman_wunsch.align(seq1, seq2, self.gap_penalty, self.engine)
+        with profiling.section('output', len(seq1)):
+            self.outputforanalysis(align1, align2, seq2, itempartid, times, seq1)
 
     def parse_errors(self):
         # write header
         header = "\"PARTID\"\t\"SENTID\"\t\"Typed\"\t\"Intended\"\t\"ERRORFREE\"\t\"IKI\"\n"
-       
-        with codecs.open(self.output_file, 'wb', 'utf-8') as out:
-            out.write(header)
+        with profiling.section('parse_errors'), \
+                output_writer.OutputWriter(self.output_file, self.buffer_size, compression=self.compression) as self.out:
+            self.out.write(header)
+            self.align_keystrokes()
+        self.out = None
+
+    def align_keystrokes(self):
+        sentences = self.read_sentences()
+        if self.workers > 1:
+            parallel_alignment.align_sentences(self, sentences, self.workers)
+        else:
+            for sentence in sentences:
+                self.needle(*sentence)
+
+    def read_sentences(self):
+        # yields the arguments of needle for every sentence in the keystroke log
         lastpartid = -1
         lastsentid = -1
         lastrespid = -1
@@ -159,80 +145,59 @@ class ErrorAligner:
         keypresstimes = {}
         charcount = 0
 
-        f = pandas.ExcelFile(self.input_file)
-        df = f.parse(f.sheet_names[0])
         l = 0
-
-        while l < len(df):
-            time = float(df.ix[l][0])
-            if charcount == 0:
-                iki = 0
-            else:
-                iki = time - lasttime
-
-            typedchar = unicode(df.ix[l][1]).rstrip('"').lower()
-            typedchar = re.sub(r'backspace', '*', typedchar)
-            typedchar = re.sub(r'","', ',', typedchar)
-            typedchar = re.sub(r' ', '}', typedchar)
-            respid = df.ix[l][2]
-            if self.idmap:
-                partid = self.idmap[str(df.ix[l][4])]
-            else:
-                partid = df.ix[l][4]
-            sentid = df.ix[l][5]
-            senttext = unicode(df.ix[l][6]).rstrip().rstrip('"').lower()
-            senttext = re.sub(r'^"|"$', '', senttext)
-            senttext = re.sub(r' ', '}', senttext)
-            lastid = '\"\t\"'.join([unicode(lastpartid), unicode(lastsentid)])
-            # keypresstimes[charcount] = iki
-            #  ti = str(charcount) + " " + str(iki)
-            # print(ti)
+        for row in keystroke_reader.read_keystrokes(self.input_file, self.input_format):
+            # a row that starts a new sentence is processed again once the last sentence is aligned
+            processed = False
+            while not processed:
+                time = float(row[0])
+                if charcount == 0:
+                    iki = 0
+                else:
+                    iki = time - lasttime
+
+                typedchar = unicode(row[1]).rstrip('"').lower()
+                typedchar = re.sub(r'backspace', '*', typedchar)
+                typedchar = re.sub(r'","', ',', typedchar)
+                typedchar = re.sub(r' ', '}', typedchar)
+                respid = row[2]
+                if self.idmap:
+                    partid = self.idmap[str(row[4])]
+                else:
+                    partid = row[4]
+                sentid = row[5]
+                senttext = unicode(row[6]).rstrip().rstrip('"').lower()
+                senttext = re.sub(r'^"|"$', '', senttext)
+                senttext = re.sub(r' ', '}', senttext)
+                lastid = '\"\t\"'.join([unicode(lastpartid), unicode(lastsentid)])
+                # keypresstimes[charcount] = iki
+                #  ti = str(charcount) + " " + str(iki)
+                # print(ti)
          
-            if (sentid != lastsentid or partid != lastpartid or respid != lastrespid) and l > 1:
-                # Change IF statement below to check sentence not already processed by making sure
-                # lastid not in a done vector, as could break if different participants version of
-                # the same sentence were to follow each other
-                if senttext != lastsenttext:
-                    self.needle(typedtext, lastsenttext, lastid, keypresstimes)
-                    keypresstimes = {}
-                typedtext = ""
-                #typedtext += typedchar
-                charcount = 0
-            else:
-                #print(charcount)
-                #print(typedchar)
-                keypresstimes[charcount] = iki
-                typedtext += typedchar
-                l += 1
-                charcount += 1
-            lastpartid = partid
-            lastsentid = sentid
-            lastrespid = respid
-            lastsenttext = senttext
-            lasttime = time
-        self.needle(typedtext, lastsenttext, lastid, keypresstimes) 
-
-    def match_score(self, alpha, beta):
-        match_award = 1
-        mismatch_penalty = -1
-
-        if alpha == beta:
-            return match_award
-        elif alpha == '^' or beta == '^':
-            return self.gap_penalty
-        else:
-            return mismatch_penalty
-
-
-# zeros() was originally from NumPy.
-# This version is implemented by alevchuk 2011-04-10
-def zeros(shape):
-    retval = []
-    for x in range(shape[0]):
-        retval.append([])
-        for y in range(shape[1]):
-            retval[-1].append(0)
-    return retval
+                if (sentid != lastsentid or partid != lastpartid or respid != lastrespid) and l > 1:
+                    # Change IF statement below to check sentence not already processed by making sure
+                    # lastid not in a done vector, as could break if different participants version of
+                    # the same sentence were to follow each other
+                    if senttext != lastsenttext:
+                        yield typedtext, lastsenttext, lastid, keypresstimes
+                        keypresstimes = {}
+                    typedtext = ""
+                    #typedtext += typedchar
+                    charcount = 0
+                else:
+                    #print(charcount)
+                    #print(typedchar)
+                    keypresstimes[charcount] = iki
+                    typedtext += typedchar
+                    l += 1
+                    charcount += 1
+                    processed = True
+                lastpartid = partid
+                lastsentid = sentid
+                lastrespid = respid
+                lastsenttext = senttext
+                lasttime = time
+        yield typedtext, lastsenttext, lastid, keypresstimes
 
 
 def finderrorlocation(intendedword, typedword):
@@ -250,16 +215,29 @@ def finderrorlocation(intendedword, typedword):
     return int(len(typedword))
 
 if __name__ == '__main__':
-    if len(sys.argv) > 4 or len(sys.argv) < 3:
-        print("FORMAT: input_file output_file [language]")
-        sys.exit(1)
-
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-
-    if len(sys.argv) > 3:
-        language = sys.argv[3]
-        aligner = ErrorAligner(input_file, output_file, language)
-    else:
-        aligner = ErrorAligner(input_file, output_file)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input_file')
+    parser.add_argument('output_file')
+    parser.add_argument('language', nargs='?', default='english')
+    parser.add_argument('--engine', default='python', choices=sorted(needleman_wunsch.ENGINES),
+                        help='alignment engine (default: python); banded uses less memory than numpy on long '
+                             'sentences of similar length, but is not faster')
+    parser.add_argument('--input-format', choices=keystroke_reader.FORMATS,
+                        help='format of the keystroke log (default: guessed from the file extension)')
+    parser.add_argument('--buffer-size', type=int, default=output_writer.DEFAULT_BUFFER_SIZE,
+                        help='size in bytes of the output write buffer')
+    parser.add_argument('--compression', choices=output_writer.COMPRESSIONS,
+                        help='compress the output file (default: guessed from the output file extension)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes that align sentences in parallel (default: 1)')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time, rows and memory of every section of the alignment at the end')
+    parser.add_argument('--profile-json', metavar='FILE', help='like --profile, and also write the report to FILE')
+    args = parser.parse_args()
+    if args.profile or args.profile_json:
+        profiling.enable()
+
+    aligner = ErrorAligner(args.input_file, args.output_file, args.language, args.engine, args.input_format,
+                           args.buffer_size, args.compression, args.workers)
     aligner.parse_errors()
+    profiling.write_report(args.profile_json)
@@ -0,0 +1,208 @@
+from __future__ import division
+import argparse
+import io
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+import helper_functions as helper
+import log_config
+import needleman_wunsch
+from alignment import ErrorAligner
+from feature_extraction_common import NGRAM_FEATURES, KEYBOARD_DISTANCE_FEATURES, CONTEXT_OFFSET
+from feature_extraction_parkinsons import FeatureExtractor
+
+# Throughput benchmark on synthetic data, as the participant data and the Europarl language
+# models can't leave the secure environment. A keystroke log in the layout ErrorAligner reads
+# and a small character ARPA model are generated from a seed, then the aligner, every stage of
+# FeatureExtractor.extract_features and the language model and keyboard lookups are timed
+# separately. The report is written as JSON, e.g. to compare runs before and after a change:
+#   python benchmark.py --sentences 200 --output before.json
+
+WORDS = (u'the of and to in is that for it as was with be by on not he this are or his from at which but have an '
+         u'they you were her she there been one all we their has would when if so no will more can other some '
+         u'what about into than them only could new time these two may first then do any like my now over such '
+         u'our man me even most made after also did many before must through years where much your way well down '
+         u'should because each just those people how too little state good very make world still own see men work '
+         u'long here get both between life being under never day same another know while last might us great old '
+         u'year off come since against go came right used take three').split()
+LETTERS = u'abcdefghijklmnopqrstuvwxyz'
+START_TIME = 1000  # ms
+
+
+def generate_keystrokes(file_name, participants=3, sentences=40, words_per_sentence=8, error_rate=0.05,
+                        backspace_rate=0.5, seed=1):
+    """
+    Writes a tab separated keystroke log (see keystroke_reader) with one response per sentence.
+    :param
+        error_rate: probability that a character of the sentence is mistyped.
+        backspace_rate: probability that a mistyped character is corrected with a backspace;
+            the other errors are substitutions, insertions and omissions in equal parts.
+    :return: the number of keystrokes and the sentences that were typed.
+    """
+    rand = random.Random(seed)
+    keystrokes = 0
+    texts = []
+    time_ms = START_TIME
+    with io.open(file_name, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(u'time\tkey\trespid\tx\tpartid\tsentid\tsenttext\n')
+        for participant in range(participants):
+            for sentence in range(sentences):
+                length = max(1, int(rand.gauss(words_per_sentence, words_per_sentence / 4)))
+                text = u' '.join(rand.choice(WORDS) for _ in range(length)) + u'.'
+                texts.append(text)
+                keys = []
+                for char in text:
+                    if rand.random() >= error_rate:
+                        keys.append(char)
+                        continue
+                    wrong = rand.choice(LETTERS)
+                    kind = rand.random()
+                    if kind < backspace_rate:
+                        keys.extend([wrong, u'backspace', char])
+                    elif kind < backspace_rate + (1 - backspace_rate) / 3:
+                        keys.append(wrong)
+                    elif kind < backspace_rate + 2 * (1 - backspace_rate) / 3:
+                        keys.extend([wrong, char])
+                for key in keys:
+                    time_ms += rand.randint(50, 400)
+                    f.write(u'%d\t%s\t%d\t0\t%d\t%d\t"%s"\n' % (time_ms, key, sentence, 100 + participant, sentence,
+                                                               text))
+                keystrokes += len(keys)
+    return keystrokes, texts
+
+
+def generate_language_model(file_name, texts, max_order=5):
+    # maximum likelihood character n-gram model of the texts, with a constant backoff weight
+    counts = dict((order, Counter()) for order in range(1, max_order + 1))
+    for text in texts:
+        tokens = [u'<s>'] + [u'}' if char == u' ' else char for char in text.lower()] + [u'</s>']
+        for order in counts:
+            for start in range(len(tokens) - order + 1):
+                counts[order][tuple(tokens[start:start + order])] += 1
+    total = sum(counts[1].values())
+    with io.open(file_name, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(u'\n\\data\\\n')
+        for order in sorted(counts):
+            f.write(u'ngram %d=%d\n' % (order, len(counts[order])))
+        for order in sorted(counts):
+            f.write(u'\n\\%d-grams:\n' % order)
+            for ngram, count in sorted(counts[order].items()):
+                history = counts[order - 1][ngram[:-1]] if order > 1 else total
+                line = u'%.7g\t%s' % (math.log10(count / history), u' '.join(ngram))
+                if order < max_order:
+                    line += u'\t%.7g' % math.log10(0.4)
+                f.write(line + u'\n')
+        f.write(u'\n\\end\\\n')
+
+
+def peak_rss_mb():
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def measure(function, items, unit='rows'):
+    # runs function once, and returns its result and the timings for items processed
+    start = time.time()
+    result = function()
+    seconds = time.time() - start
+    return result, {'seconds': seconds, unit: items, unit + '_per_second': items / seconds if seconds else None,
+                    'peak_rss_mb': peak_rss_mb()}
+
+
+def run_benchmark(work_dir, participants=3, sentences=40, words_per_sentence=8, error_rate=0.05, backspace_rate=0.5,
+                  seed=1, engine='python', workers=1):
+    report = {'parameters': {'participants': participants, 'sentences': sentences,
+                             'words_per_sentence': words_per_sentence, 'error_rate': error_rate,
+                             'backspace_rate': backspace_rate, 'seed': seed, 'engine': engine, 'workers': workers}}
+    keystroke_file = os.path.join(work_dir, 'keystrokes.tsv')
+    alignment_file = os.path.join(work_dir, 'errors.txt')
+    lm_file = os.path.join(work_dir, 'chars.lm')
+    keystrokes, texts = generate_keystrokes(keystroke_file, participants, sentences, words_per_sentence, error_rate,
+                                            backspace_rate, seed)
+    generate_language_model(lm_file, texts)
+    report['input'] = {'keystrokes': keystrokes, 'sentences': len(texts)}
+
+    aligner = ErrorAligner(keystroke_file, alignment_file, engine=engine, workers=workers)
+    _, report['alignment'] = measure(aligner.parse_errors, keystrokes, 'keystrokes')
+    with io.open(alignment_file, encoding='utf-8') as f:
+        error_rows = sum(1 for _ in f) - 1
+    report['alignment']['rows'] = error_rows
+    report['alignment']['rows_per_second'] = error_rows / report['alignment']['seconds']
+
+    extractor = FeatureExtractor('english', alignment_file, os.path.join(work_dir, 'features.csv'),
+                                 os.path.join(work_dir, 'features'), lm_file, extras=True)
+    fe = extractor.fe
+    df, read = measure(lambda: fe.create_data_frame(alignment_file, drop_column=False), error_rows)
+    report['extraction'] = {'read': read, 'stages': {}}
+    for stage in extractor.stages():
+        df, report['extraction']['stages'][stage] = measure(lambda: getattr(extractor, stage)(df), len(df))
+    stages = report['extraction']['stages'].values() + [read]
+    seconds = sum(timing['seconds'] for timing in stages)
+    report['extraction']['total'] = {'seconds': seconds, 'rows': error_rows,
+                                     'rows_per_second': error_rows / seconds if seconds else None}
+
+    # the lookups behind the keyboard and n-gram features, batched and one at a time
+    contexts = fe.error_contexts(df)
+    ngrams = [ngram for _, word, length, direction in NGRAM_FEATURES
+              for ngram in fe.ngrams(contexts, word, length, direction)]
+    pairs = [(contexts[word][1][:, CONTEXT_OFFSET], contexts[other_word][1][:, CONTEXT_OFFSET + offset])
+             for _, word, other_word, offset in KEYBOARD_DISTANCE_FEATURES]
+    first_chars = [char for first, _ in pairs for char in first]
+    second_chars = [char for _, second in pairs for char in second]
+    helper.prob_cache.clear()
+    report['lookups'] = {}
+    _, report['lookups']['lm_batch'] = measure(lambda: helper.score_many(ngrams, fe.lm), len(ngrams), 'lookups')
+    _, report['lookups']['lm_single'] = measure(lambda: [helper.get_prob_chars(ngram, fe.lm) for ngram in ngrams],
+                                                len(ngrams), 'lookups')
+    report['lookups']['lm_single']['cache'] = helper.get_prob_cache_stats()
+    _, report['lookups']['keyboard_batch'] = measure(
+        lambda: fe.keyboard_distance.distances(first_chars, second_chars), len(first_chars), 'lookups')
+    _, report['lookups']['keyboard_single'] = measure(
+        lambda: [fe.keyboard_distance.calculate_distance(first, second)
+                 for first, second in zip(first_chars, second_chars)], len(first_chars), 'lookups')
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--participants', type=int, default=3)
+    parser.add_argument('--sentences', type=int, default=40, help='sentences per participant')
+    parser.add_argument('--words', type=int, default=8, help='average words per sentence')
+    parser.add_argument('--error-rate', type=float, default=0.05, help='probability that a character is mistyped')
+    parser.add_argument('--backspace-rate', type=float, default=0.5,
+                        help='probability that a mistyped character is corrected with a backspace')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--engine', default='python', choices=sorted(needleman_wunsch.ENGINES))
+    parser.add_argument('--workers', type=int, default=1, help='processes that align sentences')
+    parser.add_argument('--output', help='file to write the JSON report to (default: standard output)')
+    parser.add_argument('--work-dir', help='keep the generated files in this directory')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='benchmark')
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    # the log files go with the generated files, instead of into the working directory
+    log_config.set_log_directory(work_dir)
+    # progress messages go to stderr, so that standard output is just the report
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        result = run_benchmark(work_dir, args.participants, args.sentences, args.words, args.error_rate,
+                               args.backspace_rate, args.seed, args.engine, args.workers)
+    finally:
+        sys.stdout = stdout
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=1, sort_keys=True)
+    else:
+        print(json.dumps(result, indent=1, sort_keys=True))
@@ -0,0 +1,300 @@
+import hashlib
+import io
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+
+# Columnar checkpoints of the feature extraction. Columns are saved in named groups (e.g.
+# one per stage), so adding or recomputing a feature only writes its own columns, and
+# loading reads just the columns that are asked for. The row index is stored once, and
+# manifest.json lists the groups and the columns in data frame order, plus small values
+# that belong with the rows (see info).
+
+FORMATS = ('parquet', 'feather', 'npy')
+MANIFEST = 'manifest.json'
+INDEX = 'index.npy'
+
+
+def default_format():
+    # parquet and feather need pyarrow, otherwise every column is saved as a .npy file
+    try:
+        import pyarrow
+        return 'parquet'
+    except ImportError:
+        return 'npy'
+
+
+def fingerprint(*parts):
+    # stage key from the inputs and parameters of a stage; json, so that str and unicode hash the same
+    return hashlib.sha1(json.dumps(parts)).hexdigest()
+
+
+def file_digest(file_name, block_size=1024 * 1024):
+    # hash of the contents of a file
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_stamp(file_name):
+    # cheaper than file_digest for big files that are replaced rather than edited, like language models
+    stat = os.stat(file_name)
+    return os.path.abspath(file_name), stat.st_size, int(stat.st_mtime)
+
+
+def is_text(values):
+    # whether an object column can be stored as a fixed width unicode array
+    return all(type(value) is unicode and not value.endswith(u'\x00') for value in values)
+
+
+class CheckpointStore:
+    """
+      Directory of feature columns. With the npy format, numeric and text columns are
+      memory-mapped when they are loaded; other object columns are pickled.
+    """
+
+    def __init__(self, directory, file_format=None):
+        self.directory = directory
+        self.manifest_file = os.path.join(directory, MANIFEST)
+        if os.path.exists(self.manifest_file):
+            with io.open(self.manifest_file, encoding='utf-8') as f:
+                self.manifest = json.load(f)
+            if file_format is not None and file_format != self.manifest['format']:
+                raise ValueError('The checkpoint ' + directory + ' is stored as ' + self.manifest['format'])
+        else:
+            file_format = file_format or default_format()
+            if file_format not in FORMATS:
+                raise ValueError('The checkpoint format ' + file_format + ' is not supported yet!')
+            self.manifest = self.empty_manifest(file_format)
+        self.manifest.setdefault('keys', {})
+        self.manifest.setdefault('index', INDEX)
+        self.manifest.setdefault('info', {})
+        self.file_format = self.manifest['format']
+        self.reserved = set()  # files of the old version while replace writes the new one
+
+    @staticmethod
+    def empty_manifest(file_format):
+        return {'format': file_format, 'columns': [], 'groups': {}, 'files': {}, 'keys': {}, 'index': INDEX,
+                'info': {}}
+
+    def exists(self):
+        return os.path.exists(self.manifest_file)
+
+    def columns(self):
+        return list(self.manifest['columns'])
+
+    def groups(self):
+        return dict((group, list(columns)) for group, columns in self.manifest['groups'].items())
+
+    def key(self, group):
+        # key the group was saved with, see fingerprint
+        return self.manifest['keys'].get(group)
+
+    def info(self, name):
+        return self.manifest['info'].get(name)
+
+    def update(self, keys=None, info=None):
+        # sets the keys of groups and info values without touching the columns
+        self.manifest['keys'].update(keys or {})
+        self.manifest['info'].update(info or {})
+        self.write_manifest()
+
+    def save(self, group, df, columns=None, key=None):
+        """
+        Saves columns of df (all of them by default) as group, replacing an older version of
+        the group. The index of df has to be the one of the checkpoint, if it has one already.
+        key identifies the inputs the columns were computed from.
+        """
+        self.save_group(group, df, columns, key)
+        self.write_manifest()
+
+    def replace(self, df, groups, keys=None, info=None):
+        """
+        Replaces the whole checkpoint with the rows of df, whose columns are saved as groups
+        (pairs of group and columns). The files are written next to the old ones, and only
+        the manifest switches to them, so an interrupted replace leaves the old checkpoint.
+        """
+        keys = keys or {}
+        old_manifest = self.manifest
+        old_files = self.files()
+        self.reserved = old_files
+        self.manifest = self.empty_manifest(self.file_format)
+        self.manifest['info'] = dict(info or {})
+        if INDEX in old_files:
+            self.manifest['index'] = self.unused_file(os.path.splitext(INDEX)[0], '.npy')
+        try:
+            for group, columns in groups:
+                self.save_group(group, df, columns, keys.get(group))
+            self.write_manifest()
+        except:
+            self.remove_files(self.files() - old_files)
+            self.manifest = old_manifest
+            raise
+        finally:
+            self.reserved = set()
+        self.remove_files(old_files - self.files())
+
+    def remove_files(self, files):
+        for file_name in files:
+            path = os.path.join(self.directory, file_name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def files(self):
+        # files of the current version, without the manifest
+        files = set(entry['file'] for entry in self.manifest['files'].values())
+        files.add(self.manifest['index'])
+        return files
+
+    def save_group(self, group, df, columns=None, key=None):
+        if columns is None:
+            columns = list(df.columns)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.save_index(df.index)
+
+        # columns that were in the old version of the group only are dropped, and columns
+        # that move to this group from another one are dropped from there
+        for column in self.manifest['groups'].get(group, []):
+            if column not in columns:
+                self.remove_column(column)
+        for other, other_columns in self.manifest['groups'].items():
+            if other != group:
+                remaining = [column for column in other_columns if column not in columns]
+                if remaining:
+                    self.manifest['groups'][other] = remaining
+                else:
+                    del self.manifest['groups'][other]
+                    self.manifest['keys'].pop(other, None)
+        self.manifest['groups'][group] = list(columns)
+        if key is None:
+            self.manifest['keys'].pop(group, None)
+        else:
+            self.manifest['keys'][group] = key
+        for column in columns:
+            if column not in self.manifest['columns']:
+                self.manifest['columns'].append(column)
+
+        if self.file_format == 'npy':
+            for column in columns:
+                self.save_npy(column, df[column])
+        else:
+            file_name = self.group_file(group)
+            data = df[list(columns)].reset_index(drop=True)
+            if self.file_format == 'parquet':
+                data.to_parquet(os.path.join(self.directory, file_name))
+            else:
+                data.to_feather(os.path.join(self.directory, file_name))
+            for column in columns:
+                self.manifest['files'][column] = {'file': file_name}
+
+    def remove_column(self, column):
+        self.manifest['columns'].remove(column)
+        entry = self.manifest['files'].pop(column)
+        path = os.path.join(self.directory, entry['file'])
+        if self.file_format == 'npy' and os.path.exists(path):
+            os.remove(path)
+
+    def clear(self):
+        # removes all columns and the index, e.g. before extracting the features of new rows
+        self.remove_files(self.files() | set([MANIFEST]))
+        self.manifest = self.empty_manifest(self.file_format)
+
+    def save_index(self, index):
+        index_file = os.path.join(self.directory, self.manifest['index'])
+        values = np.asarray(index)
+        if os.path.exists(index_file) and self.manifest['columns']:
+            saved = np.load(index_file, allow_pickle=True)
+            if len(saved) != len(values) or not (saved == values).all():
+                raise ValueError('The rows of ' + self.directory + ' differ from the ones being saved')
+        else:
+            np.save(index_file, values)
+
+    def save_npy(self, column, series):
+        values = series.values
+        dtype = str(values.dtype)
+        if values.dtype == object:
+            if is_text(values):
+                values = values.astype(unicode)
+            else:
+                dtype = 'pickle'
+        file_name = self.column_file(column)
+        np.save(os.path.join(self.directory, file_name), values, allow_pickle=(dtype == 'pickle'))
+        self.manifest['files'][column] = {'file': file_name, 'dtype': dtype}
+
+    def column_file(self, column):
+        if column in self.manifest['files']:
+            return self.manifest['files'][column]['file']
+        return self.unused_file(re.sub(r'\W+', '_', column, flags=re.UNICODE).strip('_') or 'column', '.npy')
+
+    def group_file(self, group):
+        name = re.sub(r'\W+', '_', group).strip('_')
+        if self.reserved:
+            return self.unused_file(name, '.' + self.file_format)
+        return name + '.' + self.file_format
+
+    def unused_file(self, name, extension):
+        # name + extension, with a number added if a file of this or the old version has it
+        taken = self.files() | self.reserved
+        file_name = name + extension
+        suffix = 1
+        while file_name in taken or file_name == MANIFEST:
+            suffix += 1
+            file_name = '%s_%d%s' % (name, suffix, extension)
+        return file_name
+
+    def write_manifest(self):
+        # written through a temporary file, so that a crash never leaves half a manifest behind
+        temporary = self.manifest_file + '.tmp'
+        with io.open(temporary, 'w', encoding='utf-8') as f:
+            f.write(unicode(json.dumps(self.manifest, indent=1, sort_keys=True)))
+        if os.name == 'nt' and os.path.exists(self.manifest_file):
+            os.remove(self.manifest_file)
+        os.rename(temporary, self.manifest_file)
+
+    def load(self, columns=None, mmap=True):
+        """
+        Data frame of the given columns (all of them by default), in checkpoint order.
+        With mmap, the npy files are memory-mapped instead of read in one go.
+        """
+        if not self.exists():
+            raise IOError('There is no checkpoint in ' + self.directory)
+        if columns is None:
+            columns = self.manifest['columns']
+        else:
+            missing = [column for column in columns if column not in self.manifest['files']]
+            if missing:
+                raise KeyError('Columns not in the checkpoint: ' + ', '.join(missing))
+            columns = [column for column in self.manifest['columns'] if column in columns]
+        mmap_mode = 'r' if mmap else None
+        index = pd.Index(np.load(os.path.join(self.directory, self.manifest['index']), allow_pickle=True))
+
+        data = {}
+        if self.file_format == 'npy':
+            for column in columns:
+                entry = self.manifest['files'][column]
+                path = os.path.join(self.directory, entry['file'])
+                if entry['dtype'] == 'pickle':
+                    values = np.load(path, allow_pickle=True)
+                elif entry['dtype'] == 'object':
+                    values = np.load(path, mmap_mode=mmap_mode).astype(object)
+                else:
+                    values = np.load(path, mmap_mode=mmap_mode)
+                data[column] = values
+        else:
+            files = {}
+            for column in columns:
+                files.setdefault(self.manifest['files'][column]['file'], []).append(column)
+            for file_name, file_columns in files.items():
+                path = os.path.join(self.directory, file_name)
+                if self.file_format == 'parquet':
+                    group = pd.read_parquet(path, columns=file_columns)
+                else:
+                    group = pd.read_feather(path, columns=file_columns)
+                for column in file_columns:
+                    data[column] = group[column].values
+        return pd.DataFrame(data, index=index, columns=columns)
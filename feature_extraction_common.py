@@ -1,15 +1,59 @@
 from __future__ import division
 __author__ = 'elisa'
 import helper_functions as helper
+import log_config
 import logging
+import numpy as np
 import pandas as pd
 from pyxdameraulevenshtein import damerau_levenshtein_distance
 from keyboard_distance import KeyboardDistance
-
-logger = logging.getLogger('feature_extraction_common')
-logger.setLevel(logging.DEBUG)
-fh = logging.FileHandler('feature_extraction_common.log')
-logger.addHandler(fh)
+import language_model
+import profiling
+
+logger = log_config.get_logger('feature_extraction_common')
+
+CONTEXT_OFFSET = 4  # error contexts hold the characters at offsets -4..+4 from the error
+
+# sentence columns of the alignment output, which the normalized layout (alignment.py
+# --sentence-file) keeps in a sentence table that the error rows refer to by Sentence ID
+CONTEXT_COLUMNS = ['Raw Typed Context', 'Intended Context']
+
+EDIT_DISTANCE_CACHE_SIZE = 100000  # (intended, typed) suffix pairs kept by edit_distance_cache
+
+# the same misspellings recur across rows and chunks, so their edit distances are kept
+edit_distance_cache = helper.LRUCache(EDIT_DISTANCE_CACHE_SIZE)
+
+# (column, word, other word, offset), in the order of the columns added by
+# FeatureExtractor.extract_features. The distance is between the character at the error in
+# word and the character at offset from the error in other word.
+KEYBOARD_DISTANCE_FEATURES = [('keyboard_distance_typed_after', 'typed', 'typed', 1),
+                              ('keyboard_distance_typed_before', 'typed', 'typed', -1),
+                              ('keyboard_distance_same', 'typed', 'intended', 0),
+                              ('keyboard_distance_intended_after', 'intended', 'intended', 1),
+                              ('keyboard_distance_intended_after2', 'intended', 'intended', 2),
+                              ('keyboard_distance_intended_before', 'intended', 'intended', -1),
+                              ('keyboard_distance_intended_before2', 'intended', 'intended', -2)]
+
+# (column, word, length, direction), in the order of the columns added by
+# FeatureExtractor.extract_features
+NGRAM_FEATURES = [('ngram1_prob_typed', 'typed', 1, 'after'),
+                  ('ngram2_prob_typed_before', 'typed', 2, 'before'),
+                  ('ngram3_prob_typed_before', 'typed', 3, 'before'),
+                  ('ngram4_prob_typed_before', 'typed', 4, 'before'),
+                  ('ngram5_prob_typed_before', 'typed', 5, 'before'),
+                  ('ngram2_prob_typed_after', 'typed', 2, 'after'),
+                  ('ngram3_prob_typed_after', 'typed', 3, 'after'),
+                  ('ngram4_prob_typed_after', 'typed', 4, 'after'),
+                  ('ngram5_prob_typed_after', 'typed', 5, 'after'),
+                  ('ngram1_prob_intended', 'intended', 1, 'after'),
+                  ('ngram2_prob_intended_before', 'intended', 2, 'before'),
+                  ('ngram3_prob_intended_before', 'intended', 3, 'before'),
+                  ('ngram4_prob_intended_before', 'intended', 4, 'before'),
+                  ('ngram5_prob_intended_before', 'intended', 5, 'before'),
+                  ('ngram2_prob_intended_after', 'intended', 2, 'after'),
+                  ('ngram3_prob_intended_after', 'intended', 3, 'after'),
+                  ('ngram4_prob_intended_after', 'intended', 4, 'after'),
+                  ('ngram5_prob_intended_after', 'intended', 5, 'after')]
 
 
 class FeatureExtractionCommon:
@@ -18,15 +62,38 @@ class FeatureExtractionCommon:
         self.low_freq_cutoff = low_freq_cutoff
         self.max_diff_length = max_diff_length
         self.lm_file = lm_file
+        self.lm = language_model.registry.get(lm_file)
         self.keyboard_distance = KeyboardDistance(self.language)
 
     @staticmethod
-    def save_data_frame(df, file_name):
-        df.to_csv(file_name, encoding='utf-8', index=False)
+    def save_data_frame(df, file_name, append=False):
+        # with append, df is added to the end of the file without a header
+        df.to_csv(file_name, encoding='utf-8', index=False, mode='a' if append else 'w', header=not append)
 
     @staticmethod
-    def create_data_frame(file_name, drop_column=True):
+    def create_data_frame(file_name, drop_column=True, sentence_file=None):
         df = pd.read_csv(file_name, sep='\t', encoding='utf-8', dtype={'Intended': str})
+        sentences = FeatureExtractionCommon.create_sentence_frame(sentence_file) if sentence_file else None
+        return FeatureExtractionCommon.prepare_data_frame(df, drop_column, sentences)
+
+    @staticmethod
+    def read_data_frames(file_name, chunk_size, drop_column=True, sentence_file=None):
+        # like create_data_frame, but yields data frames of chunk_size rows, indexed by row in the file
+        sentences = FeatureExtractionCommon.create_sentence_frame(sentence_file) if sentence_file else None
+        for df in pd.read_csv(file_name, sep='\t', encoding='utf-8', dtype={'Intended': str}, chunksize=chunk_size):
+            yield FeatureExtractionCommon.prepare_data_frame(df, drop_column, sentences)
+
+    @staticmethod
+    def create_sentence_frame(file_name):
+        # sentence table of the normalized layout, indexed by Sentence ID
+        return pd.read_csv(file_name, sep='\t', encoding='utf-8', index_col='Sentence ID')
+
+    @staticmethod
+    def prepare_data_frame(df, drop_column=True, sentences=None):
+        if sentences is not None:
+            FeatureExtractionCommon.join_sentences(df, sentences)
+        else:
+            FeatureExtractionCommon.share_contexts(df)
         df['Raw Typed'] = df['Raw Typed'].astype('unicode')
         df['Intended'] = df['Intended'].astype('unicode')
 
@@ -35,10 +102,38 @@ class FeatureExtractionCommon:
             df.drop(df.columns[-1], axis=1, inplace=True)
         return df
 
+    @staticmethod
+    def join_sentences(df, sentences):
+        # replaces the Sentence ID of the error rows with the contexts of their sentence, in the
+        # columns of the denormalized layout. The rows of a sentence share its string objects.
+        rows = sentences.index.get_indexer(df['Sentence ID'])
+        if (rows < 0).any():
+            raise ValueError('The sentences ' + ', '.join(str(sentence) for sentence in
+                                                          df['Sentence ID'][rows < 0].unique()) + ' are missing!')
+        position = df.columns.get_loc('Sentence ID')
+        for offset, column in enumerate(CONTEXT_COLUMNS):
+            df.insert(position + offset, column, sentences[column].values.take(rows))
+        del df['Sentence ID']
+
+    @staticmethod
+    def share_contexts(df):
+        # the denormalized layout repeats the contexts on every error row of a sentence, which
+        # read_csv turns into separate strings; rows with the same context share one instead
+        for column in CONTEXT_COLUMNS:
+            values = df[column].values
+            if values.dtype != object:
+                continue
+            codes, uniques = pd.factorize(values)
+            if (codes >= 0).all():
+                df[column] = uniques.take(codes)
+
     @staticmethod
     def create_typed_word(row):
+        return FeatureExtractionCommon.typed_word(row['Raw Typed'])
+
+    @staticmethod
+    def typed_word(word):
         typed_word = ""
-        word = row['Raw Typed']
         space = '}'
         backspace = '*'
 
@@ -72,40 +167,47 @@ class FeatureExtractionCommon:
 
     @staticmethod
     def clean_word(row):
-        intended = row['Intended'].replace('}', ' ')  # spaces at end of word should be ignore for Intended
+        return FeatureExtractionCommon.clean_intended(row['Intended'])
+
+    @staticmethod
+    def clean_intended(word):
+        intended = word.replace('}', ' ')  # spaces at end of word should be ignore for Intended
         return intended
 
     def drop_bad_rows(self, df):
         nrows_orig = len(df)
-        logger.debug('Original data frame length: ' + str(nrows_orig))
+        logger.debug('Original data frame length: %s', nrows_orig)
 
         # drop rows where intended is same as typed
         df = df.ix[~(df.Typed == df.Intended)]
         nrows_dup = len(df)
-        logger.debug('Dropped no errors: ' + str(nrows_orig-nrows_dup))
+        logger.debug('Dropped no errors: %s', nrows_orig-nrows_dup)
 
         # drop rows where Typed is a blank
         df = df.ix[~(df.Typed == '')]
         nrows_blank = len(df)
-        logger.debug('Dropped Typed blanks: ' + str(nrows_dup-nrows_blank))
+        logger.debug('Dropped Typed blanks: %s', nrows_dup-nrows_blank)
 
         # drop rows where Typed starts with a backspace, since
         # this is an alignment error
         df = df.ix[~(df.Typed.str.startswith('*'))]
         nrows_misalgined = len(df)
-        logger.debug('Dropped Typed misaligned: ' + str(nrows_blank-nrows_misalgined))
+        logger.debug('Dropped Typed misaligned: %s', nrows_blank-nrows_misalgined)
 
         # drops rows where Intended and Typed Context differ by more than cutoff, as
         # we assume this is either a bad subject or an alignment error
         df = df.ix[~(abs(df['Error Context'].str.len() - df['Intended Context'].str.len()) > self.max_diff_length)]
         nrows_toolong = len(df)
-        logger.debug('Dropped sentence diff too big: ' + str(nrows_misalgined-nrows_toolong))
+        logger.debug('Dropped sentence diff too big: %s', nrows_misalgined-nrows_toolong)
         return df
 
     @staticmethod
     def clean_context(row):
-        orig_context = row['Raw Typed Context'].replace('}', ' ')
-        orig_index = row['Original Position of word']
+        return FeatureExtractionCommon.clean_typed_context(row['Raw Typed Context'], row['Original Position of word'])
+
+    @staticmethod
+    def clean_typed_context(raw_context, orig_index):
+        orig_context = raw_context.replace('}', ' ')
         backspace = '*'
         new_context = ""
         new_index = None
@@ -137,22 +239,175 @@ class FeatureExtractionCommon:
                     backspace_counter += 1
         return new_context, new_index
 
+    @staticmethod
+    def typed_words(raw_words):
+        # typed_word of a whole column
+        return FeatureExtractionCommon.resolve_backspaces(raw_words, stop=u'}')[0]
+
+    @staticmethod
+    def clean_intended_words(words):
+        # clean_intended of a whole column
+        return [word.replace('}', ' ') for word in words]
+
+    @staticmethod
+    def clean_typed_contexts(raw_contexts, orig_indices):
+        """
+        clean_typed_context of a whole column, which cleans each distinct sentence once. Where the
+        character at the position of a row is kept in its cleaned sentence, the cleaned sentence
+        is its context, and the position is the number of characters kept before it. Otherwise
+        the error word is kept where it was backspaced over, which changes the cleaning, so those
+        rows are resolved once per distinct (context, position) pair.
+        :return: lists of the cleaned contexts and of the positions of the words in them.
+        """
+        orig_indices = np.asarray(orig_indices)
+        if len(orig_indices) == 0:
+            return [], []
+        codes, sentences = pd.factorize(np.asarray(raw_contexts, dtype=object))
+        if not np.issubdtype(orig_indices.dtype, np.integer) or (codes < 0).any() or \
+                not all(isinstance(sentence, basestring) for sentence in sentences):
+            # some contexts or positions are missing, so clean row by row
+            cleaned = [FeatureExtractionCommon.clean_typed_context(raw_context, orig_index)
+                       for raw_context, orig_index in zip(raw_contexts, orig_indices)]
+            return [context for context, _ in cleaned], [index for _, index in cleaned]
+
+        chars, starts, lengths = FeatureExtractionCommon.char_buffer(sentences)
+        kept = FeatureExtractionCommon.kept_characters(chars, starts, lengths)
+        kept_before = np.concatenate(([0], np.cumsum(kept)))
+        text = u''.join(chars[kept].tolist()).replace(u'}', u' ')
+        cleaned = np.empty(len(sentences), dtype=object)
+        cleaned[:] = [text[start:end] for start, end in zip(kept_before[starts].tolist(),
+                                                             kept_before[starts + lengths].tolist())]
+        contexts = cleaned.take(codes)
+
+        # positions outside of the context never match, like -1
+        orig_indices = orig_indices.astype(np.int64)
+        orig_indices = np.where((orig_indices >= 0) & (orig_indices < lengths[codes]), orig_indices, -1)
+        in_sentence = np.flatnonzero(orig_indices >= 0)
+        flat = starts[codes[in_sentence]] + orig_indices[in_sentence]
+        positions = np.empty(len(codes), dtype=object)
+        positions[in_sentence] = (kept_before[flat] - kept_before[starts[codes[in_sentence]]]).tolist()
+        fast = np.zeros(len(codes), dtype=bool)
+        fast[in_sentence] = kept[flat]
+        slow = np.flatnonzero(~fast)
+        if len(slow):
+            contexts[slow], positions[slow] = FeatureExtractionCommon.clean_error_words(
+                sentences, lengths, codes[slow], orig_indices[slow])
+        return contexts.tolist(), positions.tolist()
+
+    @staticmethod
+    def clean_error_words(sentences, lengths, codes, orig_indices):
+        # the rows of clean_typed_contexts whose error word is backspaced over, or whose position is -1
+        _, first, inverse = np.unique(codes * (lengths.max() + 1) + orig_indices + 1,
+                                      return_index=True, return_inverse=True)
+        pair_sentences = sentences.take(codes[first])
+        pair_indices = orig_indices[first]
+        contexts, kept_before = FeatureExtractionCommon.resolve_backspaces(pair_sentences, pair_indices)
+
+        positions = []
+        for sentence, orig_index, context, before in zip(pair_sentences, pair_indices, contexts, kept_before):
+            if orig_index < 0:
+                positions.append(None)
+            elif sentence[orig_index] == '*' and before == len(context):
+                # the error word starts with a backspace and nothing is kept after it
+                positions.append(None)
+            else:
+                positions.append(int(before))
+        contexts = [context.replace('}', ' ') for context in contexts]
+        context_codes, contexts = pd.factorize(np.array(contexts, dtype=object))
+        return contexts.take(context_codes[inverse]), [positions[pair] for pair in inverse]
+
+    @staticmethod
+    def resolve_backspaces(strings, keep=None, stop=None):
+        """
+        Replays the backspaces ('*') of typed_word and clean_typed_context on many strings at once.
+        A run of n backspaces deletes the n characters that follow it, i.e. a character is kept
+        when no deletions are pending. Pending deletions go up at a backspace and down at any
+        other character, never below 0, which is a floored cumulative sum over the flat array
+        of all characters.
+        :param
+            keep: index of a character in each string (or -1) that is kept anyway, after which no
+                deletions are pending; a backspace there is not kept but otherwise counts as usual.
+            stop: leave out the characters from the first stop character of each string on.
+        :return: the resolved strings, and for each string the number of characters kept before
+            its keep index (-1 if there is none).
+        """
+        chars, starts, lengths = FeatureExtractionCommon.char_buffer(strings)
+        ends = starts + lengths
+        if keep is None:
+            keep = np.empty(len(lengths), dtype=np.int64)
+            keep.fill(-1)
+        keep = np.asarray(keep, dtype=np.int64)
+        has_keep = (keep >= 0) & (keep < lengths)
+        kept = FeatureExtractionCommon.kept_characters(chars, starts, lengths, keep, stop)
+
+        kept_before = np.concatenate(([0], np.cumsum(kept)))
+        text = u''.join(chars[kept].tolist())
+        resolved = [text[start:end] for start, end in zip(kept_before[starts].tolist(), kept_before[ends].tolist())]
+        kept_before_keep = np.empty(len(lengths), dtype=np.int64)
+        kept_before_keep.fill(-1)
+        kept_before_keep[has_keep] = kept_before[(starts + keep)[has_keep]] - kept_before[starts[has_keep]]
+        return resolved, kept_before_keep
+
+    @staticmethod
+    def kept_characters(chars, starts, lengths, keep=None, stop=None):
+        # mask of the characters of a char_buffer that resolve_backspaces keeps, see there for keep and stop
+        total = len(chars)
+        ends = starts + lengths
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        is_backspace = chars == u'*'
+
+        # pending deletions restart from 0 at the start of each string and after each kept character
+        segment_start = np.zeros(total, dtype=bool)
+        segment_start[starts[lengths > 0]] = True
+        if keep is None:
+            keep = np.empty(len(lengths), dtype=np.int64)
+            keep.fill(-1)
+        has_keep = (keep >= 0) & (keep < lengths)
+        forced = (starts + keep)[has_keep]
+        forced = forced[~is_backspace[forced]]
+        after_forced = forced + 1
+        segment_start[after_forced[after_forced < ends[rows[forced]]]] = True
+
+        steps = np.where(is_backspace, 1, -1)
+        sums = np.cumsum(steps)
+        sums_before = np.concatenate(([0], sums))
+        segments = np.cumsum(segment_start) - 1
+        # running minimum within each segment: later segments are shifted below all earlier ones
+        shift = segments * (2 * total + 2)
+        running_min = np.minimum.accumulate(sums - shift) + shift
+        base = sums_before[np.flatnonzero(segment_start)][segments]
+        pending = sums - np.minimum(base, running_min)
+        pending_before = np.zeros(total, dtype=np.int64)
+        pending_before[1:] = pending[:-1]
+        pending_before[segment_start] = 0
+
+        kept = ~is_backspace & (pending_before == 0)
+        kept[forced] = True
+        if stop is not None:
+            stops = np.concatenate(([0], np.cumsum(chars == stop)))
+            kept &= stops[1:] == stops[starts[rows]]
+        return kept
+
     @staticmethod
     def get_error_index(row):
+        return FeatureExtractionCommon.error_index(row.Typed, row.Intended)
+
+    @staticmethod
+    def error_index(typed, intended):
         error_start = None
-        for index, letter in enumerate(row.Typed):
+        for index, letter in enumerate(typed):
             # stop when we reach the end of an intended word
             # that is shorter than the typed word
-            if index == len(row.Intended):
+            if index == len(intended):
                 error_start = index
                 break
             # or a mismatched letter
-            elif row.Intended[index] != letter:
+            elif intended[index] != letter:
                 error_start = index
                 break
             # or the end of a typed word that is the same as
             # intended but missing letters at the end
-            elif index == len(row.Typed)-1:
+            elif index == len(typed)-1:
                 error_start = index+1
                 break
         return error_start
@@ -167,17 +422,55 @@ class FeatureExtractionCommon:
 
     @staticmethod
     def get_edit_distance(row):
-        return damerau_levenshtein_distance(row.Intended[row.error_start_intended:], row.Typed[row.error_start_typed:])
+        return FeatureExtractionCommon.edit_distance(row.Typed, row.Intended, row.error_start_typed,
+                                                     row.error_start_intended)
+
+    @staticmethod
+    def edit_distance(typed, intended, error_start_typed, error_start_intended):
+        return damerau_levenshtein_distance(intended[error_start_intended:], typed[error_start_typed:])
+
+    @staticmethod
+    def error_locations(typed_words, intended_words):
+        """
+        error_index, the error ends and edit_distance of whole columns, with the error starting at
+        the same index in both words. Each distinct pair of words is located once, and the edit
+        distances of the suffix pairs are memoized in edit_distance_cache.
+        :return: lists of error_start, error_end_typed, error_end_intended and edit_distance.
+        """
+        locations = {}
+        rows = []
+        for pair in zip(typed_words, intended_words):
+            location = locations.get(pair)
+            if location is None:
+                typed, intended = pair
+                error_start = FeatureExtractionCommon.error_index(typed, intended)
+                suffixes = (intended[error_start:], typed[error_start:])
+                distance = edit_distance_cache.get(suffixes)
+                if distance is None:
+                    distance = damerau_levenshtein_distance(*suffixes)
+                    edit_distance_cache.put(suffixes, distance)
+                # max accounts for an error when the last letter is omitted
+                location = (error_start, max(len(typed)-1, error_start), max(len(intended)-1, error_start), distance)
+                locations[pair] = location
+            rows.append(location)
+        if not rows:
+            return [], [], [], []
+        return [list(column) for column in zip(*rows)]
 
     @staticmethod
     def get_following_char_from_context(row, offset=0):
+        return FeatureExtractionCommon.following_char(row['Error Context'], row['Position of word'], len(row['Typed']),
+                                                      offset)
+
+    @staticmethod
+    def following_char(context, position, length_typed, offset=0):
         # sometimes we don't have the full context, so just hard-code next letter to space
-        if row['Position of word'] > len(row['Error Context']):
+        if position > len(context):
             logger.debug('Went past limit!')
             char = u' '
         # if this is the last word in the context, or we've gone past the end,
         # then hard-code next letter to period
-        elif row['Position of word']+len(row['Typed'])+offset >= len(row['Error Context']):
+        elif position+length_typed+offset >= len(context):
             logger.debug('At the end of context!')
             if offset == 0:
                 char = u'.'
@@ -187,32 +480,137 @@ class FeatureExtractionCommon:
                 logger.warning('Offset is greater than 1, so entering land of speculation. Will set following char to blank space.')
                 char = u' '
         else:
-            logger.debug('From context with length_typed: %s', str(len(row['Typed'])))
-            logger.debug(row['Error Context'])
-            char = row['Error Context'][row['Position of word']+len(row['Typed'])+offset]
+            char = context[position+length_typed+offset]
         return char
 
     @staticmethod
     def get_previous_char_from_context(row, offset=1):
+        return FeatureExtractionCommon.previous_char(row['Error Context'], row['Position of word'], offset)
+
+    @staticmethod
+    def previous_char(context, position, offset=1):
         # sometimes we don't have the full context, so just hard-code previous letter to space
-        if row['Position of word'] > len(row['Error Context']):
+        if position > len(context):
             logger.debug('Went past limit!')
             char = u' '
         # if this is the first word in the wikipedia article, hard-code previous letter to space
-        elif row['Position of word'] == 0:
+        elif position == 0:
             logger.debug('At the end of article!')
             char = u' '
         # get previous letter from context
         else:
-            logger.debug('From context')
-            logger.debug(row['Error Context'])
-            logger.debug(row['Position of word'])
-
-            char = row['Error Context'][row['Position of word']-offset]
+            char = context[position-offset]
         return char
 
+    def error_context(self, typed, intended, error_start_typed, error_start_intended, context, position):
+        """
+        Characters around the error of one row, so that the features don't have to look them up again.
+        :return: for the typed and the intended word, the mistyped character (see get_mistyped_char)
+            and the characters at offsets -CONTEXT_OFFSET..CONTEXT_OFFSET from the error, the same as
+            get_mistyped_char_and_before/after return, i.e. falling back to the error context.
+        """
+        following = {}
+        record = []
+        for word, error_index in ((typed, error_start_typed), (intended, error_start_intended)):
+            chars = []
+            for offset in range(-CONTEXT_OFFSET, CONTEXT_OFFSET+1):
+                index = error_index + offset
+                if index < 0:
+                    chars.append(self.previous_char(context, position, -index))
+                elif index >= len(word):
+                    word_offset = index - len(word)
+                    if word_offset not in following:
+                        following[word_offset] = self.following_char(context, position, len(typed), word_offset)
+                    chars.append(following[word_offset])
+                else:
+                    chars.append(word[index])
+            # error is after last letter of word (i.e., last letter was omitted)
+            record.append(u' ' if len(word) == error_index else word[error_index])
+            record.append(chars)
+        return record
+
+    def error_contexts(self, df):
+        """
+        error_context of every row, computed for all rows at once.
+        :return: dict from 'typed' and 'intended' to an array of the mistyped characters and a
+            (rows, 2*CONTEXT_OFFSET+1) array of the characters around the error, both of dtype U1.
+        """
+        columns = [df['Position of word'].values, df['error_start_typed'].values, df['error_start_intended'].values]
+        if not all(np.issubdtype(column.dtype, np.integer) for column in columns):
+            # some positions are missing, so fall back to the row by row lookups
+            return self.error_contexts_by_row(df)
+        positions, error_start_typed, error_start_intended = [column.astype(np.int64) for column in columns]
+        context = self.char_buffer(df['Error Context'])
+        typed = self.char_buffer(df['Typed'])
+        intended = self.char_buffer(df['Intended'])
+        typed_lengths = typed[2]
+        return {'typed': self.context_window(typed, error_start_typed, context, positions, typed_lengths),
+                'intended': self.context_window(intended, error_start_intended, context, positions, typed_lengths)}
+
+    def error_contexts_by_row(self, df):
+        records = [self.error_context(*values) for values in zip(df['Typed'], df['Intended'], df['error_start_typed'],
+                                                                  df['error_start_intended'], df['Error Context'],
+                                                                  df['Position of word'])]
+        width = 2 * CONTEXT_OFFSET + 1
+        contexts = {}
+        for index, word in enumerate(('typed', 'intended')):
+            mistyped = np.array([record[2 * index] for record in records], dtype='U1')
+            chars = np.array([record[2 * index + 1] for record in records], dtype='U1').reshape(len(records), width)
+            contexts[word] = (mistyped, chars)
+        return contexts
+
+    @staticmethod
+    def char_buffer(strings):
+        # the strings as one flat array of characters, with where each string starts in it and its length
+        strings = list(strings)
+        lengths = np.array([len(string) for string in strings], dtype=np.int64)
+        starts = np.cumsum(lengths) - lengths
+        chars = np.array(list(u''.join(strings)), dtype='U1')
+        return chars, starts, lengths
+
+    @staticmethod
+    def context_window(word, error_index, context, positions, typed_lengths):
+        # vectorized error_context of one of the words, with the rules of previous_char and following_char
+        word_chars, word_starts, word_lengths = word
+        context_chars, context_starts, context_lengths = context
+        index = error_index[:, None] + np.arange(-CONTEXT_OFFSET, CONTEXT_OFFSET+1)
+        chars = np.empty(index.shape, dtype='U1')
+        chars.fill(u' ')
+
+        inside = (index >= 0) & (index < word_lengths[:, None])
+        chars[inside] = word_chars[(word_starts[:, None] + index)[inside]]
+
+        # sometimes we don't have the full context, so the char stays a space
+        past_limit = (positions > context_lengths)[:, None]
+
+        # before the word, unless it's the first word of the article
+        before = (index < 0) & ~past_limit & (positions != 0)[:, None]
+        context_index = positions[:, None] + index
+        context_index = np.where(context_index < 0, context_index + context_lengths[:, None], context_index)
+        if (context_index[before] < 0).any():
+            raise IndexError('string index out of range')
+        chars[before] = context_chars[(context_starts[:, None] + context_index)[before]]
+
+        # after the word, with a period and then spaces past the end of the context
+        word_offset = index - word_lengths[:, None]
+        after = (word_offset >= 0) & ~past_limit
+        context_index = (positions + typed_lengths)[:, None] + word_offset
+        at_end = after & (context_index >= context_lengths[:, None])
+        chars[at_end & (word_offset == 0)] = u'.'
+        if (at_end & (word_offset > 1)).any():
+            logger.warning('Offset is greater than 1 for %d chars, so entering land of speculation. '
+                           'Will set following char to blank space.', (at_end & (word_offset > 1)).sum())
+        inside_context = after & ~at_end
+        chars[inside_context] = context_chars[(context_starts[:, None] + context_index)[inside_context]]
+
+        # error is after last letter of word (i.e., last letter was omitted)
+        mistyped = chars[:, CONTEXT_OFFSET].copy()
+        mistyped[error_index == word_lengths] = u' '
+        return mistyped, chars
+
     def get_mistyped_char_and_before(self, row, word, error_index, offset=1):
-        logger.debug('ID: ' + str(row.ID))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('ID: %s', row.ID)
         # error is after last letter of word (i.e., last letter was ommitted)
         if len(word) == error_index:
             first_char = self.get_following_char_from_context(row)
@@ -221,17 +619,18 @@ class FeatureExtractionCommon:
 
         # second char is before beginning of word
         if error_index - offset < 0:
-            logger.debug('Error index: %s' % error_index)
+            logger.debug('Error index: %s', error_index)
             word_offset = offset - error_index
-            logger.debug('Word offset: %s' % word_offset)
+            logger.debug('Word offset: %s', word_offset)
             second_char = self.get_previous_char_from_context(row, word_offset)
         else:
             second_char = word[error_index - offset]
-        logger.debug('get_mistyped_char_and_before return: %s, %s' % (first_char, second_char))
+        logger.debug('get_mistyped_char_and_before return: %s, %s', first_char, second_char)
         return first_char, second_char
 
     def get_mistyped_char_and_after(self, row, word, error_index, offset=1):
-        logger.debug('get_mistyped_char_and_after enter: ID: ' + str(row.ID))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('get_mistyped_char_and_after enter: ID: %s', row.ID)
         # error is after last letter of word (i.e., last letter was ommitted)
         if len(word) == error_index:
             first_char = self.get_following_char_from_context(row)
@@ -241,14 +640,14 @@ class FeatureExtractionCommon:
 
             # second char will go past end of word
             if len(word) <= error_index + offset:
-                logger.debug('Error index: %s' % error_index)
+                logger.debug('Error index: %s', error_index)
                 word_offset = error_index + offset - len(word)
-                logger.debug('Word offset: %s' % word_offset)
+                logger.debug('Word offset: %s', word_offset)
                 second_char = self.get_following_char_from_context(row, word_offset)
             else:
                 second_char = word[error_index + offset]
 
-        logger.debug('get_mistyped_char_and_after return: %s, %s' % (first_char, second_char))
+        logger.debug('get_mistyped_char_and_after return: %s, %s', first_char, second_char)
         return first_char, second_char
 
     @staticmethod
@@ -258,7 +657,7 @@ class FeatureExtractionCommon:
             mistyped_char = u' '
         else:
             mistyped_char = word[error_index]
-        logger.debug('get_mistyped_char return:  %s' % mistyped_char)
+        logger.debug('get_mistyped_char return:  %s', mistyped_char)
         return mistyped_char
 
     def keyboard_distance_typed_before(self, row):
@@ -290,8 +689,13 @@ class FeatureExtractionCommon:
         return self.keyboard_distance.calculate_distance(first_char, second_char)
 
     def keyboard_distance_same(self, row):
-        logger.debug(row.Typed)
-        logger.debug(row.Intended)
+        first_char, second_char = self.keyboard_distance_same_chars(row)
+        return self.keyboard_distance.calculate_distance(first_char, second_char)
+
+    def keyboard_distance_same_chars(self, row):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(row.Typed)
+            logger.debug(row.Intended)
         # error is after last letter of word (i.e., last letter was ommitted)
         if len(row.Typed) == row.error_start_typed:
             first_char = self.get_following_char_from_context(row)
@@ -305,7 +709,37 @@ class FeatureExtractionCommon:
             second_char = row.Intended[row.error_start_intended]
         logger.debug(first_char)
         logger.debug(second_char)
-        return self.keyboard_distance.calculate_distance(first_char, second_char)
+        return first_char, second_char
+
+    def keyboard_distance_features(self, contexts):
+        # all keyboard distance features from the error contexts, with one lookup in the
+        # distance matrix per feature, returned as (feature name, values) in column order
+        features = []
+        for feature, word, other_word, offset in KEYBOARD_DISTANCE_FEATURES:
+            first_chars = contexts[word][1][:, CONTEXT_OFFSET]
+            second_chars = contexts[other_word][1][:, CONTEXT_OFFSET + offset]
+            with profiling.section(feature, len(first_chars)):
+                features.append((feature, self.keyboard_distance.distances(first_chars, second_chars)))
+        return features
+
+    def extra_features(self, df, contexts):
+        # misaligned_sequence and same_hand_after/before, as (feature name, values) in column order
+        first_chars = contexts['intended'][1][:, CONTEXT_OFFSET]
+        after_chars = contexts['intended'][1][:, CONTEXT_OFFSET + 1]
+        before_chars = contexts['intended'][1][:, CONTEXT_OFFSET - 1]
+        with profiling.section('misaligned_sequence', len(df)):
+            length_misaligned_typed, length_misaligned_intended, operations = self.misaligned_sequences(df)
+        with profiling.section('same_hand_after', len(df)):
+            same_hand_after = [self.keyboard_distance.same_hand(first, second)
+                               for first, second in zip(first_chars, after_chars)]
+        with profiling.section('same_hand_before', len(df)):
+            same_hand_before = [self.keyboard_distance.same_hand(first, second)
+                                for first, second in zip(first_chars, before_chars)]
+        return [('length_misaligned_typed', length_misaligned_typed),
+                ('length_misaligned_intended', length_misaligned_intended),
+                ('misaligned_operation', operations),
+                ('same_hand_after', same_hand_after),
+                ('same_hand_before', same_hand_before)]
 
     def same_hand_after(self, row):
         first_char, second_char = self.get_mistyped_char_and_after(row, row.Intended, row.error_start_intended)
@@ -316,192 +750,201 @@ class FeatureExtractionCommon:
         return self.keyboard_distance.same_hand(first_char, second_char)
 
     def length_misaligned_sequence(self, row):
-        logger.debug('length_misaligned_sequence enter: %s, %s' % (row.Typed, row.Intended))
+        length_misaligned_typed, length_misaligned_intended, _ = self.misaligned_sequence(
+            row.Typed, row.Intended, row.error_start_typed, row.error_start_intended, row.error_end_typed,
+            row.error_end_intended, row['Error Context'], row['Position of word'])
+        return length_misaligned_typed, length_misaligned_intended
 
-        length_misaligned_typed = None
-        length_misaligned_intended = None
-        found_match = False
-        offset = 0
+    @staticmethod
+    def misaligned_sequence(typed, intended, error_start_typed, error_start_intended, error_end_typed,
+                            error_end_intended, context, position):
+        """
+        Lengths of the misaligned sequences in the typed and the intended word, and the operation
+        that explains them: substitution, migration, insertion, deletion (also of the last letter),
+        or a combination of them. The characters after the error are compared in one pass, in
+        which a substitution wins over a migration, and a migration over a deletion of the last
+        letter; past the end of a word, they continue with the context after the typed word.
+        """
+        def next_char(word, error_start, offset):
+            # second char of get_mistyped_char_and_after
+            index = error_start + offset
+            if index < len(word):
+                return word[index]
+            return FeatureExtractionCommon.following_char(context, position, len(typed), index - len(word))
+
+        typed_steps = 1 + error_end_typed - error_start_typed
+        intended_steps = 1 + error_end_intended - error_start_intended
+        length_after_typed = len(typed[error_start_typed:error_end_typed])
+        length_after_intended = len(intended[error_start_intended:error_end_intended])
+        mistyped_typed = FeatureExtractionCommon.get_mistyped_char(typed, error_start_typed)
+        mistyped_intended = FeatureExtractionCommon.get_mistyped_char(intended, error_start_intended)
 
-        length_after_typed = len(row.Typed[row.error_start_typed:row.error_end_typed])
-        length_after_intended = len(row.Intended[row.error_start_intended:row.error_end_intended])
-        # substitution/migration/deletion of last letter
         if length_after_typed == length_after_intended:
-            logger.debug('substitution or migration or deletion of last letter')
-            while not found_match and row.error_start_typed+offset <= row.error_end_typed:
-                offset += 1
-                _, next_typed = self.get_mistyped_char_and_after(row, row.Typed, row.error_start_typed, offset)
-                _, next_intended = self.get_mistyped_char_and_after(row, row.Intended, row.error_start_intended, offset)
+            migration, deletion = None, None
+            for offset in range(1, typed_steps + 1):
+                next_typed = next_char(typed, error_start_typed, offset)
+                next_intended = next_char(intended, error_start_intended, offset)
                 if next_typed == next_intended:
-                    logger.debug('substitution')
-                    found_match = True
-                    length_misaligned_typed = offset
-                    length_misaligned_intended = offset
-
-            # start over and check for migration instead
-            if not found_match:
-                offset = 0
-                while not found_match and row.error_start_typed+offset <= row.error_end_typed:
-                    offset += 1
-                    _, next_typed = self.get_mistyped_char_and_after(row, row.Typed, row.error_start_typed, offset)
-                    mistyped_intended = self.get_mistyped_char(row.Intended, row.error_start_intended)
-                    if next_typed == mistyped_intended:
-                        logger.debug('migration')
-                        found_match = True
-                        length_misaligned_typed = offset
-                        length_misaligned_intended = 0
-
-            # start over and check for deletion of last letter instead
-            if not found_match:
-                offset = 0
-                while not found_match and row.error_start_intended+offset <= row.error_end_intended:
-                    offset += 1
-                    mistyped_typed = self.get_mistyped_char(row.Typed, row.error_start_typed)
-                    _, next_intended = self.get_mistyped_char_and_after(row, row.Intended, row.error_start_intended, offset)
-                    if mistyped_typed == next_intended:
-                        logger.debug('deletion of last letter')
-                        found_match = True
-                        length_misaligned_typed = 0
-                        length_misaligned_intended = offset
-
-        # insertion
+                    return offset, offset, 'substitution'
+                if migration is None and next_typed == mistyped_intended:
+                    migration = offset
+                if deletion is None and mistyped_typed == next_intended:
+                    deletion = offset
+            if migration is not None:
+                return migration, 0, 'migration'
+            if deletion is not None:
+                return 0, deletion, 'deletion'
         elif length_after_typed > length_after_intended:
-            logger.debug('insertion')
-            while not found_match and row.error_start_typed+offset <= row.error_end_typed:
-                offset += 1
-                _, next_typed = self.get_mistyped_char_and_after(row, row.Typed, row.error_start_typed, offset)
-                mistyped_intended = self.get_mistyped_char(row.Intended, row.error_start_intended)
-                if next_typed == mistyped_intended:
-                    found_match = True
-                    length_misaligned_typed = offset
-                    length_misaligned_intended = 0
-
-        # deletion
-        elif length_after_typed < length_after_intended:
-            logger.debug('deletion')
-            while not found_match and row.error_start_intended+offset <= row.error_end_intended:
-                offset += 1
-                mistyped_typed = self.get_mistyped_char(row.Typed, row.error_start_typed)
-                _, next_intended = self.get_mistyped_char_and_after(row, row.Intended, row.error_start_intended, offset)
-                if mistyped_typed == next_intended:
-                    found_match = True
-                    length_misaligned_typed = 0
-                    length_misaligned_intended = offset
+            for offset in range(1, typed_steps + 1):
+                if next_char(typed, error_start_typed, offset) == mistyped_intended:
+                    return offset, 0, 'insertion'
+        else:
+            for offset in range(1, intended_steps + 1):
+                if mistyped_typed == next_char(intended, error_start_intended, offset):
+                    return 0, offset, 'deletion'
 
         # combination of operations like substitution + deletion/insertion
-        if not found_match:
-            logger.debug('combination')
-            length_misaligned_typed = 1+row.error_end_typed - row.error_start_typed
-            length_misaligned_intended = 1+row.error_end_intended - row.error_start_intended
-
-        logger.debug('length_misaligned_sequence exit: %s, %s' % (length_misaligned_typed, length_misaligned_intended))
-        return length_misaligned_typed, length_misaligned_intended
+        return typed_steps, intended_steps, 'combination'
+
+    def misaligned_sequences(self, df):
+        # misaligned_sequence of every row, as lists of the typed and intended lengths and the operations
+        rows = [self.misaligned_sequence(*values)
+                for values in zip(df['Typed'], df['Intended'], df['error_start_typed'], df['error_start_intended'],
+                                  df['error_end_typed'], df['error_end_intended'], df['Error Context'],
+                                  df['Position of word'])]
+        if not rows:
+            return [], [], []
+        return [list(column) for column in zip(*rows)]
 
     def get_ngram_before(self, row, word, error_index, offset):
         all_chars = self.get_mistyped_char(word, error_index)
         for index in range(1, offset+1):
             _, prev_char = self.get_mistyped_char_and_before(row, word, error_index, index)
             all_chars = prev_char + all_chars
-        logger.debug('Word: %s' % word)
-        logger.debug('get_ngram_before return: %s' % all_chars)
+        logger.debug('Word: %s', word)
+        logger.debug('get_ngram_before return: %s', all_chars)
         return all_chars
 
     def get_ngram_after(self, row, word, error_index, offset):
-        logger.debug('Word: %s' % word)
+        logger.debug('Word: %s', word)
         all_chars = self.get_mistyped_char(word, error_index)
         for index in range(1, offset+1):
             _, after_char = self.get_mistyped_char_and_after(row, word, error_index, index)
             all_chars = all_chars + after_char
-        logger.debug('Word: %s' % word)
-        logger.debug('get_ngram_after return: %s' % all_chars)
+        logger.debug('Word: %s', word)
+        logger.debug('get_ngram_after return: %s', all_chars)
         return all_chars
 
+    @staticmethod
+    def ngrams(contexts, word, length, direction):
+        # the strings get_ngram_before/after return for every row, from the error contexts
+        # slices of the window, read as one U<length> string per row
+        mistyped, chars = contexts[word]
+        if direction == 'before':
+            window = np.column_stack([chars[:, CONTEXT_OFFSET - length + 1:CONTEXT_OFFSET], mistyped])
+        else:
+            window = np.column_stack([mistyped, chars[:, CONTEXT_OFFSET + 1:CONTEXT_OFFSET + length]])
+        return np.ascontiguousarray(window).view('U%d' % length).ravel().tolist()
+
+    def ngram_features(self, contexts):
+        # all n-gram probability features from the error contexts, as (feature name, values) in column order.
+        # The columns are scored together, so that n-grams repeated across them are looked up once.
+        rows = len(contexts['typed'][0])
+        ngrams = []
+        for feature, word, length, direction in NGRAM_FEATURES:
+            with profiling.section(feature, rows):
+                ngrams.append(self.ngrams(contexts, word, length, direction))
+        with profiling.section('score_many', rows * len(NGRAM_FEATURES)):
+            probs = helper.score_many([ngram for column in ngrams for ngram in column], self.lm, as_written=True)
+        return [(feature, probs[index * rows:(index + 1) * rows])
+                for index, (feature, _, _, _) in enumerate(NGRAM_FEATURES)]
+
     def ngram1_prob_intended(self, row):
-        logger.debug('ngram1_prob_intended_before, ID: %s' % row.ID)
+        logger.debug('ngram1_prob_intended_before, ID: %s', row.ID)
         char = self.get_mistyped_char(row.Intended, row.error_start_intended)
-        return helper.get_prob_chars(char, self.lm_file)
+        return helper.get_prob_chars(char, self.lm)
 
     def ngram2_prob_intended_before(self, row):
-        logger.debug('ngram2_prob_intended_before, ID: %s' % row.ID)
+        logger.debug('ngram2_prob_intended_before, ID: %s', row.ID)
         all_chars = self.get_ngram_before(row, row.Intended, row.error_start_intended, 1)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
 
     def ngram3_prob_intended_before(self, row):
-        logger.debug('ngram3_prob_intended_before, ID: %s' % row.ID)
+        logger.debug('ngram3_prob_intended_before, ID: %s', row.ID)
         all_chars = self.get_ngram_before(row, row.Intended, row.error_start_intended, 2)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
 
     def ngram4_prob_intended_before(self, row):
-        logger.debug('ngram4_prob_intended_before, ID: %s' % row.ID)
+        logger.debug('ngram4_prob_intended_before, ID: %s', row.ID)
         all_chars = self.get_ngram_before(row, row.Intended, row.error_start_intended, 3)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
 
     def ngram5_prob_intended_before(self, row):
-        logger.debug('ngram5_prob_intended_before, ID: %s' % row.ID)
+        logger.debug('ngram5_prob_intended_before, ID: %s', row.ID)
         all_chars = self.get_ngram_before(row, row.Intended, row.error_start_intended, 4)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
 
     def ngram2_prob_intended_after(self, row):
-        logger.debug('ngram2_prob_intended_after, ID: %s' % row.ID)
+        logger.debug('ngram2_prob_intended_after, ID: %s', row.ID)
         all_chars = self.get_ngram_after(row, row.Intended, row.error_start_intended, 1)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
 
     def ngram3_prob_intended_after(self, row):
-        logger.debug('ngram3_prob_intended_after, ID: %s' % row.ID)
+        logger.debug('ngram3_prob_intended_after, ID: %s', row.ID)
         all_chars = self.get_ngram_after(row, row.Intended, row.error_start_intended, 2)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
 
     def ngram4_prob_intended_after(self, row):
-        logger.debug('ngram4_prob_intended_after, ID: %s' % row.ID)
+        logger.debug('ngram4_prob_intended_after, ID: %s', row.ID)
         all_chars = self.get_ngram_after(row, row.Intended, row.error_start_intended, 3)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
 
     def ngram5_prob_intended_after(self, row):
-        logger.debug('ngram5_prob_intended_after, ID: %s' % row.ID)
+        logger.debug('ngram5_prob_intended_after, ID: %s', row.ID)
         all_chars = self.get_ngram_after(row, row.Intended, row.error_start_intended, 4)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
 
     def ngram1_prob_typed(self, row):
-        logger.debug('ngram1_prob_typed, ID: %s' % row.ID)
+        logger.debug('ngram1_prob_typed, ID: %s', row.ID)
         char = self.get_mistyped_char(row.Typed, row.error_start_typed)
-        return helper.get_prob_chars(char, self.lm_file)
+        return helper.get_prob_chars(char, self.lm)
 
     def ngram2_prob_typed_before(self, row):
-        logger.debug('ngram2_prob_typed_before, ID: %s' % row.ID)
+        logger.debug('ngram2_prob_typed_before, ID: %s', row.ID)
         all_chars = self.get_ngram_before(row, row.Typed, row.error_start_typed, 1)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
 
     def ngram3_prob_typed_before(self, row):
-        logger.debug('ngram3_prob_typed_before, ID: %s' % row.ID)
+        logger.debug('ngram3_prob_typed_before, ID: %s', row.ID)
         all_chars = self.get_ngram_before(row, row.Typed, row.error_start_typed, 2)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
 
     def ngram4_prob_typed_before(self, row):
-        logger.debug('ngram4_prob_typed_before, ID: %s' % row.ID)
+        logger.debug('ngram4_prob_typed_before, ID: %s', row.ID)
         all_chars = self.get_ngram_before(row, row.Typed, row.error_start_typed, 3)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
 
     def ngram5_prob_typed_before(self, row):
-        logger.debug('ngram5_prob_typed_before, ID: %s' % row.ID)
+        logger.debug('ngram5_prob_typed_before, ID: %s', row.ID)
         all_chars = self.get_ngram_before(row, row.Typed, row.error_start_typed, 4)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
 
     def ngram2_prob_typed_after(self, row):
-        logger.debug('ngram2_prob_typed_after, ID: %s' % row.ID)
+        logger.debug('ngram2_prob_typed_after, ID: %s', row.ID)
         all_chars = self.get_ngram_after(row, row.Typed, row.error_start_typed, 1)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
 
     def ngram3_prob_typed_after(self, row):
-        logger.debug('ngram3_prob_typed_after, ID: %s' % row.ID)
+        logger.debug('ngram3_prob_typed_after, ID: %s', row.ID)
         all_chars = self.get_ngram_after(row, row.Typed, row.error_start_typed, 2)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
 
     def ngram4_prob_typed_after(self, row):
-        logger.debug('ngram4_prob_typed_after, ID: %s' % row.ID)
+        logger.debug('ngram4_prob_typed_after, ID: %s', row.ID)
         all_chars = self.get_ngram_after(row, row.Typed, row.error_start_typed, 3)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
 
     def ngram5_prob_typed_after(self, row):
-        logger.debug('ngram5_prob_typed_after, ID: %s' % row.ID)
+        logger.debug('ngram5_prob_typed_after, ID: %s', row.ID)
         all_chars = self.get_ngram_after(row, row.Typed, row.error_start_typed, 4)
-        return helper.get_prob_chars(all_chars, self.lm_file)
+        return helper.get_prob_chars(all_chars, self.lm)
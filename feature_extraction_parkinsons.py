@@ -1,115 +1,372 @@
 __author__ = 'elisa'
-import logging
-import pickle
+import argparse
+import log_config
 import os, sys
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import feature_extraction_common
+import helper_functions as helper
+import language_model
+import parallel_extraction
+import profiling
+from checkpoint import CheckpointStore, file_digest, file_stamp, fingerprint
 from feature_extraction_common import FeatureExtractionCommon
 
-logger = logging.getLogger('feature_extraction_parkinsons')
-logger.setLevel(logging.DEBUG)
-fh = logging.FileHandler('feature_extraction_parkinsons.log')
-logger.addHandler(fh)
+logger = log_config.get_logger('feature_extraction_parkinsons')
+
+
+# stages of the extraction, in order, with a version that is part of their key in the
+# checkpoint, so that changing a stage only invalidates that stage and the ones after it
+STAGES = [('preprocess', 1), ('base', 1), ('keyboard', 1), ('ngram', 1), ('extras', 2)]
 
 
 class FeatureExtractor:
     def __init__(self, language="english",
                  input_file='input'+os.path.sep+'errors_parkinsons_spanish.txt',
                  output_file='output'+os.path.sep+'output_spanish_parkinsons.csv',
-                 pickle_file='output'+os.path.sep+'spanish_parkinsons.p',
-                 lm_file="Typing-UT/LanguageModel/Spanish/SpanishEuroparl-noShift.lm"):
+                 checkpoint_dir='output'+os.path.sep+'spanish_parkinsons.features',
+                 lm_file="Typing-UT/LanguageModel/Spanish/SpanishEuroparl-noShift.lm", extras=False, workers=1,
+                 sentence_file=None):
+        """
+        Constructor.
+        :param
+            checkpoint_dir: where the columns of every stage are saved, so that a rerun skips the
+                stages whose inputs haven't changed.
+            extras: whether to add the length_misaligned, misaligned_operation and same_hand features.
+            workers: number of processes that extract the features; the output is the same for any number.
+            sentence_file: sentence table of an input file in the normalized layout (alignment.py
+                --sentence-file); the output is the same as for the denormalized input.
+        """
         self.input_file = input_file
+        self.sentence_file = sentence_file
         self.output_file = output_file
-        self.pickle_file = pickle_file
+        self.checkpoint = CheckpointStore(checkpoint_dir)
         self.lm_file = lm_file
+        self.include_extras = extras
+        self.workers = workers
+        self.pool = None
+        self.worker_stats = {}  # cache stats of the worker processes, by process id
+        self.added_features = {}  # feature -> function of add_feature, for the new rows of run_incremental
         self.fe = FeatureExtractionCommon(lm_file, language)
 
-    def run_extractor(self):
-        df = self.fe.create_data_frame(self.input_file, drop_column=False)
-        df = self.extract_features(df)
-        self.fe.save_data_frame(df, self.output_file)
+    def run_extractor(self, incremental=False, chunk_size=None):
+        if self.workers > 1:
+            # forked after the language model is opened, see parallel_extraction
+            self.pool = parallel_extraction.start_pool(self, self.workers)
+        try:
+            if chunk_size:
+                self.run_chunked(chunk_size)
+            else:
+                df = self.run_incremental() if incremental else self.run_stages()
+                with profiling.section('write', len(df)):
+                    self.fe.save_data_frame(df, self.output_file)
+            if self.pool is not None:
+                self.pool.close()
+        except:
+            if self.pool is not None:
+                self.pool.terminate()
+            raise
+        finally:
+            if self.pool is not None:
+                self.pool.join()
+                self.pool = None
+
+    def run_chunked(self, chunk_size):
+        """
+        Streams the input file through all stages in blocks of chunk_size rows, so that memory
+        depends on the chunk size rather than on the input. The features of each block are
+        spilled to a temporary directory, and written to the output file once the column types
+        of all blocks are known (e.g. a block without missing values has int columns where the
+        whole file has floats), so the output is the same as the one of run_stages. The
+        checkpoint isn't used.
+        """
+        spill_dir = tempfile.mkdtemp(prefix='features', dir=os.path.dirname(os.path.abspath(self.output_file)))
+        try:
+            spilled = []
+            empty_frames = []
+            for chunk in self.fe.read_data_frames(self.input_file, chunk_size, drop_column=False,
+                                                     sentence_file=self.sentence_file):
+                features = self.extract_features(chunk)
+                if len(features) == 0:
+                    continue
+                file_name = os.path.join(spill_dir, '%d.pkl' % len(spilled))
+                features.to_pickle(file_name)
+                spilled.append(file_name)
+                empty_frames.append(features.iloc[:0])
+                print('Extracted features of rows %d to %d' % (chunk.index[0], chunk.index[-1]))
+                logger.debug('Extracted features of rows %d to %d', chunk.index[0], chunk.index[-1])
+            if not spilled:
+                print('No rows left to write')
+                return
+
+            # the types the columns would have in one data frame
+            dtypes = pd.concat(empty_frames).dtypes
+            for number, file_name in enumerate(spilled):
+                features = pd.read_pickle(file_name)
+                for column in features.columns:
+                    if features[column].dtype != dtypes[column]:
+                        features[column] = features[column].astype(dtypes[column])
+                with profiling.section('write', len(features)):
+                    self.fe.save_data_frame(features, self.output_file, append=number > 0)
+        finally:
+            shutil.rmtree(spill_dir)
 
     def extract_features(self, df):
-        ## preprocess data first
+        # all stages on a data frame read with create_data_frame, without the checkpoint
+        for stage in self.stages():
+            df = self.run_stage(stage, df)
+        return df
+
+    def run_stage(self, stage, df):
+        with profiling.section(stage, len(df)):
+            if self.pool is None:
+                return getattr(self, stage)(df)
+            return parallel_extraction.run_stage(self.pool, self.workers, stage, df, self.worker_stats)
+
+    def cache_stats(self):
+        # hits and misses of the lookup caches in this process and the workers, for the profiling report
+        stats = [self.process_cache_stats()] + self.worker_stats.values()
+        return dict((cache, profiling.merge_stats([process_stats[cache] for process_stats in stats]))
+                    for cache in stats[0])
+
+    def process_cache_stats(self):
+        return {'lm_probabilities': helper.get_prob_cache_stats(), 'lm_scores': helper.get_score_stats(),
+                'keyboard': self.fe.keyboard_distance.cache_stats(),
+                'edit_distance': feature_extraction_common.edit_distance_cache.stats()}
+
+    def reset_cache_stats(self):
+        helper.reset_stats()
+        self.fe.keyboard_distance.lookups.clear()
+        feature_extraction_common.edit_distance_cache.reset_stats()
+
+    def stages(self):
+        return [stage for stage, _ in STAGES if stage != 'extras' or self.include_extras]
+
+    def stage_keys(self, preprocess_key=None):
+        # each key covers the parameters of the stage and the key of the stage it builds on
+        versions = dict(STAGES)
+        if preprocess_key is None:
+            sentences = [file_digest(self.sentence_file)] if self.sentence_file else []
+            preprocess_key = fingerprint('preprocess', versions['preprocess'], file_digest(self.input_file),
+                                         self.fe.max_diff_length, *sentences)
+        keys = {'preprocess': preprocess_key}
+        keys['base'] = fingerprint('base', versions['base'], keys['preprocess'])
+        keys['keyboard'] = fingerprint('keyboard', versions['keyboard'], keys['base'], self.fe.language)
+        keys['ngram'] = fingerprint('ngram', versions['ngram'], keys['base'], file_stamp(self.fe.lm.path))
+        keys['extras'] = fingerprint('extras', versions['extras'], keys['base'], self.fe.language)
+        return keys
+
+    def run_stages(self):
+        keys = self.stage_keys()
+        if self.checkpoint.key('preprocess') != keys['preprocess']:
+            # the rows may have changed
+            self.checkpoint.clear()
+        df = None
+        for stage in self.stages():
+            if self.checkpoint.key(stage) == keys[stage]:
+                print('Using saved ' + stage + ' stage')
+                logger.debug('Using saved %s stage', stage)
+                columns = self.checkpoint.groups()[stage]
+                with profiling.section('load ' + stage):
+                    saved = self.checkpoint.load(columns)
+                if df is None:
+                    df = saved
+                else:
+                    for column in columns:
+                        df[column] = saved[column].values
+            elif df is None:
+                with profiling.section('read'):
+                    df = self.fe.create_data_frame(self.input_file, drop_column=False,
+                                                   sentence_file=self.sentence_file)
+                read_ids = df['ID'].copy()
+                df = self.run_stage('preprocess', df)
+                with profiling.section('save ' + stage, len(df)):
+                    self.checkpoint.save(stage, df, key=keys[stage])
+                    # so that run_incremental doesn't take the rows preprocess dropped for new ones
+                    self.checkpoint.update(info={'dropped_ids': read_ids[~read_ids.isin(df['ID'])].tolist()})
+            else:
+                old_columns = set(df.columns)
+                df = self.run_stage(stage, df)
+                with profiling.section('save ' + stage, len(df)):
+                    self.checkpoint.save(stage, df, [column for column in df.columns if column not in old_columns],
+                                         key=keys[stage])
+        return df
+
+    def run_incremental(self):
+        """
+        Only extracts the features of the rows whose ID isn't in the checkpoint yet, e.g. of
+        sessions appended to the input file, and merges them with the saved ones in the order
+        of the input file. The result is the same as the one of run_stages. The IDs of rows
+        that preprocess dropped are kept in the checkpoint, so that they aren't extracted again,
+        and the checkpoint is only rewritten if rows were added, removed or moved.
+        """
+        saved_key = self.checkpoint.key('preprocess')
+        if saved_key is None:
+            return self.run_stages()
+        # the saved stages have to come from the same parameters, only the input may differ
+        saved_keys = self.stage_keys(saved_key)
+        if any(self.checkpoint.key(stage) != saved_keys[stage] for stage in self.stages()):
+            print('Checkpoint has different parameters, extracting all features')
+            return self.run_stages()
+
+        df = self.fe.create_data_frame(self.input_file, drop_column=False, sentence_file=self.sentence_file)
+        if not df['ID'].is_unique:
+            print('IDs are not unique, extracting all features')
+            return self.run_stages()
+        groups = self.checkpoint.groups()
+        columns = [column for stage in self.stages() for column in groups[stage]]
+        # groups that aren't stages were saved by add_feature
+        stages = [stage for stage, _ in STAGES]
+        added_groups = [(group, group_columns) for group, group_columns in groups.items() if group not in stages]
+        saved = self.checkpoint.load(columns + [column for _, group_columns in added_groups
+                                                for column in group_columns])
+        dropped = pd.Series(self.checkpoint.info('dropped_ids') or [], dtype=object)
+        new_rows = df.loc[~df['ID'].isin(saved['ID']) & ~df['ID'].isin(dropped)]
+        print('Extracting features of %d rows that are not in the checkpoint' % len(new_rows))
+        logger.debug('Extracting features of %d rows that are not in the checkpoint', len(new_rows))
+
+        # saved rows that are no longer in the input are dropped, like a full run would
+        features = saved.loc[saved['ID'].isin(df['ID'])]
+        # index and order of the input file
+        positions = pd.Series(np.arange(len(df)), index=df['ID'].values)
+        index = positions[features['ID'].values].values
+        all_keys = self.stage_keys()
+        keys = dict((stage, all_keys[stage]) for stage in self.stages())
+        if len(new_rows) == 0 and len(features) == len(saved) and (index == saved.index.values).all():
+            if any(self.checkpoint.key(stage) != keys[stage] for stage in self.stages()):
+                self.checkpoint.update(keys)
+            return features[columns]
+
+        features.index = index
+        dropped = dropped[dropped.isin(df['ID'])]
+        if len(new_rows):
+            new_features = self.extract_features(new_rows.copy())
+            dropped = dropped.append(new_rows['ID'][~new_rows['ID'].isin(new_features['ID'])])
+            if len(new_features):
+                new_features.index = positions[new_features['ID'].values].values
+                features = pd.concat([features, new_features.reindex(columns=features.columns)])
+        features = features.sort_index()
+        for group, _ in added_groups:
+            if group in self.added_features:
+                features[group] = self.added_features[group](features)
+            elif len(new_rows):
+                print('The values of ' + group + ' are missing for the new rows, add it again with add_feature')
+                logger.warning('The values of %s are missing for the new rows', group)
+
+        self.checkpoint.replace(features, [(stage, groups[stage]) for stage in self.stages()] + added_groups, keys,
+                                {'dropped_ids': dropped.tolist()})
+        return features[columns]
+
+    def preprocess(self, df):
         # strip off trailing spaces
         df['Raw Typed'] = df['Raw Typed'].str.rstrip(' ')
         df['Intended'] = df['Intended'].str.rstrip(' ')
 
-        df['Typed'] = df.apply(self.fe.create_typed_word, axis=1)
-        df['Intended'] = df.apply(self.fe.clean_word, axis=1)
-        temp_df = df.apply(self.fe.clean_context, axis=1)
-        df['Error Context'], df['Position of word'] = zip(*temp_df)
-        df = self.fe.drop_bad_rows(df)
+        # features are computed column by column over plain values, without building a Series per row
+        with profiling.section('Typed', len(df)):
+            df['Typed'] = self.fe.typed_words(df['Raw Typed'])
+        with profiling.section('Intended', len(df)):
+            df['Intended'] = self.fe.clean_intended_words(df['Intended'])
+        with profiling.section('Error Context', len(df)):
+            df['Error Context'], df['Position of word'] = self.fe.clean_typed_contexts(df['Raw Typed Context'],
+                                                                                       df['Original Position of word'])
+        with profiling.section('drop_bad_rows', len(df)):
+            return self.fe.drop_bad_rows(df)
 
-        ## now extract features
-        df["diff_length"] = df["Intended"].str.len() - df["Typed"].str.len()
-        df['error_start_typed'] = df.apply(self.fe.get_error_index, axis=1)
+    def base(self, df):
+        with profiling.section('diff_length', len(df)):
+            df["diff_length"] = df["Intended"].str.len() - df["Typed"].str.len()
+        with profiling.section('error_locations', len(df)):
+            error_start, error_end_typed, error_end_intended, edit_distance = \
+                self.fe.error_locations(df['Typed'], df['Intended'])
+        df['error_start_typed'] = error_start
         df['error_start_intended'] = df['error_start_typed']
-
-        df['error_end_typed'] = df.apply(self.fe.error_end_typed, axis=1)
-        df['error_end_intended'] = df.apply(self.fe.error_end_intended, axis=1)
-        df['edit_distance'] = df.apply(self.fe.get_edit_distance, axis=1)
-        pickle.dump(df, open(self.pickle_file, "wb"))
+        df['error_end_typed'] = error_end_typed
+        df['error_end_intended'] = error_end_intended
+        df['edit_distance'] = edit_distance
         print('Created  base features')
         logger.debug('Created  base features')
+        return df
+
+    def keyboard(self, df):
+        with profiling.section('error_contexts', len(df)):
+            contexts = self.fe.error_contexts(df)
+        for feature, distances in self.fe.keyboard_distance_features(contexts):
+            df[feature] = distances
+        print('Keyboard features done')
+        logger.debug('Keyboard features done')
+        return df
 
-        df['keyboard_distance_typed_after'] = df.apply(self.fe.keyboard_distance_typed_after, axis=1)
-        df['keyboard_distance_typed_before'] = df.apply(self.fe.keyboard_distance_typed_before, axis=1)
-        df['keyboard_distance_same'] = df.apply(self.fe.keyboard_distance_same, axis=1)
-        df['keyboard_distance_intended_after'] = df.apply(self.fe.keyboard_distance_intended_after, axis=1)
-        df['keyboard_distance_intended_after2'] = df.apply(self.fe.keyboard_distance_intended_after2, axis=1)
-        df['keyboard_distance_intended_before'] = df.apply(self.fe.keyboard_distance_intended_before, axis=1)
-        df['keyboard_distance_intended_before2'] = df.apply(self.fe.keyboard_distance_intended_before2, axis=1)
-        pickle.dump(df, open(self.pickle_file, 'w'))
-        print('First dump')
-        logger.debug('First dump')
-
-        df['ngram1_prob_typed'] = df.apply(self.fe.ngram1_prob_typed, axis=1)
-        df['ngram2_prob_typed_before'] = df.apply(self.fe.ngram2_prob_typed_before, axis=1)
-        df['ngram3_prob_typed_before'] = df.apply(self.fe.ngram3_prob_typed_before, axis=1)
-        df['ngram4_prob_typed_before'] = df.apply(self.fe.ngram4_prob_typed_before, axis=1)
-        df['ngram5_prob_typed_before'] = df.apply(self.fe.ngram5_prob_typed_before, axis=1)
-        df['ngram2_prob_typed_after'] = df.apply(self.fe.ngram2_prob_typed_after, axis=1)
-        df['ngram3_prob_typed_after'] = df.apply(self.fe.ngram3_prob_typed_after, axis=1)
-        df['ngram4_prob_typed_after'] = df.apply(self.fe.ngram4_prob_typed_after, axis=1)
-        df['ngram5_prob_typed_after'] = df.apply(self.fe.ngram5_prob_typed_after, axis=1)
-
-        df['ngram1_prob_intended'] = df.apply(self.fe.ngram1_prob_intended, axis=1)
-        df['ngram2_prob_intended_before'] = df.apply(self.fe.ngram2_prob_intended_before, axis=1)
-        df['ngram3_prob_intended_before'] = df.apply(self.fe.ngram3_prob_intended_before, axis=1)
-        df['ngram4_prob_intended_before'] = df.apply(self.fe.ngram4_prob_intended_before, axis=1)
-        df['ngram5_prob_intended_before'] = df.apply(self.fe.ngram5_prob_intended_before, axis=1)
-        df['ngram2_prob_intended_after'] = df.apply(self.fe.ngram2_prob_intended_after, axis=1)
-        df['ngram3_prob_intended_after'] = df.apply(self.fe.ngram3_prob_intended_after, axis=1)
-        df['ngram4_prob_intended_after'] = df.apply(self.fe.ngram4_prob_intended_after, axis=1)
-        df['ngram5_prob_intended_after'] = df.apply(self.fe.ngram5_prob_intended_after, axis=1)
-        pickle.dump(df, open(self.pickle_file, "wb"))
+    def ngram(self, df):
+        with profiling.section('error_contexts', len(df)):
+            contexts = self.fe.error_contexts(df)
+        for feature, probs in self.fe.ngram_features(contexts):
+            df[feature] = probs
         print('ngrams done')
         logger.debug('ngrams done')
         return df
 
-    def add_feature(self):
-        df = pickle.load(open(self.pickle_file, "rb"))
-        # add feature here
-        pickle.dump(df, open(self.pickle_file, "wb"))
+    def extras(self, df):
+        with profiling.section('error_contexts', len(df)):
+            contexts = self.fe.error_contexts(df)
+        for feature, values in self.fe.extra_features(df, contexts):
+            df[feature] = values
+        print('Extra features done')
+        logger.debug('Extra features done')
+        return df
+
+    def add_feature(self, feature, function):
+        # computes one more feature column with function(df) on the checkpoint, and only writes that column;
+        # run_incremental computes it again when it adds rows
+        self.added_features[feature] = function
+        df = self.checkpoint.load()
+        df[feature] = function(df)
+        self.checkpoint.save(feature, df, [feature])
         self.fe.save_data_frame(df, self.output_file)
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print("FORMAT: language")
-        sys.exit(1)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('language')
+    parser.add_argument('--extras', action='store_true',
+                        help='also add the length_misaligned, misaligned_operation and same_hand features')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only extract the features of rows whose ID is not in the checkpoint yet')
+    parser.add_argument('--sentence-file',
+                        help='sentence table of the input file, if it was aligned with alignment.py --sentence-file')
+    parser.add_argument('--chunk-size', type=int,
+                        help='read and extract the input in blocks of this many rows, for inputs that do not fit '
+                             'in memory (does not use the checkpoint)')
+    parser.add_argument('--workers', '--jobs', type=int, default=1,
+                        help='number of processes that extract the features')
+    parser.add_argument('--debug-log', action='store_true',
+                        help='write debug messages to the <module>.log files (slow, off by default)')
+    parser.add_argument('--async-log', action='store_true',
+                        help='with --debug-log, write the log files from a background thread')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time, rows and memory of every stage and feature, and the cache hits, '
+                             'at the end')
+    parser.add_argument('--profile-json', metavar='FILE', help='like --profile, and also write the report to FILE')
+    args = parser.parse_args()
+    if args.debug_log:
+        log_config.enable_debug_logging(args.async_log)
+    if args.profile or args.profile_json:
+        profiling.enable()
 
-    language = sys.argv[1]
-    if language.lower() == "english":
-        lm_file = 'resources' + os.path.sep + "EnglishEuroparl.chars_parkinsons_casefolded.lm"
-    elif language.lower() == "spanish":
-        lm_file = 'resources' + os.path.sep + "SpanishEuroparl-noShift.lm"
+    language = args.language
+    if language.lower() in language_model.LM_FILES:
+        lm_file = language_model.LM_FILES[language.lower()]
     else:
         print "Language " + language + " is not supported yet!"
         sys.exit(1)
 
     input_file = 'input'+os.path.sep+'errors_parkinsons_' + language.lower() + '.txt'
     output_file = 'output'+os.path.sep + 'output_parkinsons_' + language.lower() + '.csv'
-    pickle_file = 'output'+os.path.sep + 'parkinsons_' + language.lower() + '.p'
+    checkpoint_dir = 'output'+os.path.sep + 'parkinsons_' + language.lower() + '.features'
         
-    feature_extractor = FeatureExtractor(language, input_file, output_file, pickle_file, lm_file)
-    feature_extractor.run_extractor()
+    feature_extractor = FeatureExtractor(language, input_file, output_file, checkpoint_dir, lm_file, args.extras,
+                                         args.workers, args.sentence_file)
+    feature_extractor.run_extractor(args.incremental, args.chunk_size)
+    profiling.write_report(args.profile_json, feature_extractor.cache_stats())
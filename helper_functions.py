@@ -1,22 +1,97 @@
 from __future__ import division
 import codecs
-import csv
+import log_config
 import logging
 import unicodedata
-import pickle
+import numpy as np
+import pandas as pd
+from collections import Counter, OrderedDict
 from py2casefold import casefold
+from checkpoint import CheckpointStore
+from language_model import CharLanguageModel, as_text, registry
 
-logger = logging.getLogger('helper_functions')
-logger.setLevel(logging.DEBUG)
-fh = logging.FileHandler('helper_functions.log')
-logger.addHandler(fh)
+logger = log_config.get_logger('helper_functions')
 
-lm_ngram1 = {}
-lm_ngram2 = {}
-lm_ngram3 = {}
-lm_ngram4 = {}
-lm_ngram5 = {}
-dict_lm_objects = {1:lm_ngram1, 2:lm_ngram2, 3:lm_ngram3, 4:lm_ngram4, 5:lm_ngram5}
+PROB_CACHE_SIZE = 100000  # n-grams kept by the get_prob_chars cache
+
+
+class LRUCache:
+    """
+      Bounded mapping that evicts the least recently used entry once it holds max_size
+      entries (a max_size of 0 disables it). Keeps hit and miss counters, and how many
+      backoff steps the cached n-gram probabilities needed.
+    """
+
+    def __init__(self, max_size=PROB_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.backoff_depths = Counter()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries[key] = value  # move to the most recently used end
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        self.entries.pop(key, None)
+        while len(self.entries) >= self.max_size:
+            self.entries.popitem(last=False)
+        self.entries[key] = value
+
+    def clear(self):
+        self.entries.clear()
+        self.reset_stats()
+
+    def reset_stats(self):
+        # keeps the entries, e.g. in a forked process that only reports its own lookups
+        self.hits = 0
+        self.misses = 0
+        self.backoff_depths.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'backoff_depths': dict(self.backoff_depths)}
+
+
+prob_cache = LRUCache()
+
+# strings scored by score_many: how many were distinct, and how many of those were found in
+# the model right away, after backing off, or not at all
+score_stats = Counter()
+
+
+def set_prob_cache_size(max_size):
+    # evicts the oldest entries if the cache shrinks
+    prob_cache.max_size = max_size
+    while len(prob_cache.entries) > max(max_size, 0):
+        prob_cache.entries.popitem(last=False)
+
+
+def get_prob_cache_stats():
+    return prob_cache.stats()
+
+
+def get_score_stats():
+    return dict(score_stats)
+
+
+def reset_stats():
+    prob_cache.reset_stats()
+    score_stats.clear()
 
 
 def has_diacritic(input_str):
@@ -48,49 +123,140 @@ def transform_for_lm(string):
     return new_string
 
 
-def get_prob_chars(string, lm_file):
-    build_prob_dicts(lm_file)
+def get_prob_chars(string, lm):
+    # lm is a CharLanguageModel, or an ARPA file or language name to look up in the registry
+    if not isinstance(lm, CharLanguageModel):
+        lm = registry.get(lm)
+    # the same short n-grams come up again and again, so they are scored only once
+    key = (lm.path, string)
+    cached = prob_cache.get(key)
+    if cached is not None:
+        return cached[0]
+    prob, depth = score_chars(string, lm)
+    prob_cache.backoff_depths[depth] += 1
+    prob_cache.put(key, (prob, depth))
+    return prob
+
+
+def score_chars(string, lm):
+    # log probability of the n-gram and the number of backoff steps it needed
+    debug = logger.isEnabledFor(logging.DEBUG)
     use_backoff_weight = False
+    depth = 0
     length = len(string)
     string_lm = transform_for_lm(string)
-    logger.debug('Original string: ' + string + ', transformed string: ' + string_lm)
+    if debug:
+        logger.debug('Original string: %s, transformed string: %s', string, string_lm)
     old_string_lm = string_lm
-    while string_lm not in dict_lm_objects[length]:
+    index = lm.lookup(string_lm, length)
+    while index is None:
         use_backoff_weight = True
         old_string_lm = string_lm
         string_lm = backoff(string_lm)
-       
-        logger.debug('Char sequence after backoff is: ' + string_lm)
+        depth += 1
         length = length-1
-        logger.debug('Length is now: ' + str(length))
+        if debug:
+            logger.debug('Char sequence after backoff is: %s', string_lm)
+            logger.debug('Length is now: %s', length)
         if length == 0:
             break
+        index = lm.lookup(string_lm, length)
 
     if length == 0:
         prob = "NA"
-        logger.debug('Prob is: ' + prob)
         use_backoff_weight = False
-    else:    
-        ngram_values = dict_lm_objects[length][string_lm]
-        prob = ngram_values[0]
-        logger.debug('Prob is: ' + str(prob))
+    elif use_backoff_weight:
+        prob = lm.log_prob(length, index)
+    else:
+        # the text of the ARPA file, as it is written to the output unchanged
+        prob = lm.log_prob_text(length, index)
+    if debug:
+        logger.debug('Prob is: %s', prob)
     if use_backoff_weight:
         backoff_string = old_string_lm[:(length*2)-1]  # account for blank spaces
-        logger.debug('Backoff_string is ' + backoff_string)
         backoff_length = int((len(backoff_string)+1)/2)  # account for blank spaces
-        logger.debug('Length of backoff string is ' + str(backoff_length))
-        if backoff_string not in dict_lm_objects[backoff_length]:
+        if debug:
+            logger.debug('Backoff_string is %s', backoff_string)
+            logger.debug('Length of backoff string is %s', backoff_length)
+        backoff_index = lm.lookup(backoff_string, backoff_length)
+        if backoff_index is None:
             backoff_weight = 0
         else:
-            ngram_values_backoff = dict_lm_objects[backoff_length][backoff_string]
-            if len(ngram_values_backoff) == 1:
-                backoff_weight = 0
-            else:
-                backoff_weight = ngram_values_backoff[1]
-        logger.debug('Backoff weight is ' + str(backoff_weight))
-        return float(prob) + float(backoff_weight)
+            backoff_weight = lm.backoff(backoff_length, backoff_index)
+        if debug:
+            logger.debug('Backoff weight is %s', backoff_weight)
+        return float(prob) + float(backoff_weight), depth
     else:
-        return prob
+        return prob, depth
+
+
+def score_many(strings, lm, as_written=False):
+    """
+    get_prob_chars of every string in an array or Series. Each distinct string is transformed
+    once, and the backoff chains of all of them are looked up in bulk in the language model.
+    :param as_written: return the values of get_prob_chars, as they are written to the output: the
+        ARPA text of n-grams in the model, floats where a backoff weight is added and "NA"
+    :return: float array, NaN where get_prob_chars returns "NA"
+    """
+    if not isinstance(lm, CharLanguageModel):
+        lm = registry.get(lm)
+    codes, uniques = pd.factorize(np.asarray(strings, dtype=object))
+
+    # backoff chains of the distinct strings, flattened from the longest n-gram to the shortest
+    candidates, orders, starts = [], [], []
+    for string in uniques:
+        starts.append(len(candidates))
+        string_lm = transform_for_lm(string)
+        for length in range(len(string), 0, -1):
+            candidates.append(string_lm)
+            orders.append(length)
+            string_lm = backoff(string_lm)
+    orders = np.array(orders, dtype=np.int64)
+    indices = lm.lookup_many(candidates, orders)
+
+    # first n-gram of each chain that is in the model, and the n-gram whose backoff weight is added
+    prob_at = np.empty(len(uniques), dtype=np.int64)
+    prob_at.fill(-1)
+    backoff_strings, backoff_orders, backed_off = [], [], []
+    for unique, string in enumerate(uniques):
+        start = starts[unique]
+        for depth in range(len(string)):
+            if indices[start + depth] >= 0:
+                prob_at[unique] = start + depth
+                if depth > 0:
+                    # same slicing as get_prob_chars
+                    backoff_string = candidates[start + depth - 1][:((len(string) - depth) * 2) - 1]
+                    backoff_strings.append(backoff_string)
+                    backoff_orders.append(int((len(backoff_string) + 1) / 2))
+                    backed_off.append(unique)
+                break
+
+    probs = np.empty(len(uniques), dtype=np.float64)
+    probs.fill(np.nan)
+    hits = prob_at >= 0
+    probs[hits] = lm.log_prob_many(orders[prob_at[hits]], indices[prob_at[hits]])
+    if as_written:
+        values = np.empty(len(uniques) + 1, dtype=object)
+        values.fill("NA")
+        values[hits.nonzero()[0]] = [as_text(prob) for prob in probs[hits]]
+    if backoff_strings:
+        backoff_orders = np.array(backoff_orders, dtype=np.int64)
+        backoff_indices = lm.lookup_many(backoff_strings, backoff_orders)
+        weights = np.zeros(len(backoff_strings), dtype=np.float64)
+        known = backoff_indices >= 0
+        weights[known] = lm.backoff_many(backoff_orders[known], backoff_indices[known])
+        probs[backed_off] += weights
+        if as_written:
+            values[backed_off] = probs[backed_off].tolist()
+    score_stats['strings'] += len(codes)
+    score_stats['distinct'] += len(uniques)
+    score_stats['found'] += int(hits.sum()) - len(backed_off)
+    score_stats['backed_off'] += len(backed_off)
+    score_stats['missing'] += len(uniques) - int(hits.sum())
+    # code -1 (a missing string) picks the NaN or "NA" at the end
+    if as_written:
+        return values[codes]
+    return np.append(probs, np.nan)[codes]
 
 
 def backoff(string):
@@ -100,36 +266,15 @@ def backoff(string):
         return string[2:]  # drop 1st character and blank space
 
 
-def build_prob_dicts(lm_file): 
-    global lm_ngram1
-    if not lm_ngram1:
-        # find correct n-gram section
-        ngram_match = "-grams:"
-        index = 0
-        with open(lm_file) as f:
-            for line in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
-                if len(line) == 0:
-                    continue
-                elif line[0].endswith(ngram_match):
-                    index += 1
-                elif len(line) < 2:
-                    continue
-                else:
-                    key = unicode(line[1], 'utf-8')
-                    if len(line) == 2:  # sometimes we don't have backoff weight
-                        dict_lm_objects[index][key] = [line[0]]
-                    else:
-                        dict_lm_objects[index][key] = [line[0], line[2]]
-
-
-def create_vocab_for_lm(pickle_file_1, pickle_file_2=None):
+def create_vocab_for_lm(checkpoint_dir_1, checkpoint_dir_2=None):
+    # characters of the error contexts in the checkpoints of feature_extraction_parkinsons
     outputfile_name = "all_chars.txt"
-    df_1 = pickle.load(open(pickle_file_1, "rb"))
+    df_1 = CheckpointStore(checkpoint_dir_1).load(['Error Context'])
     context_1 = df_1['Error Context'].str.replace(" ", "}")  # convert spaces to }
     all_chars = set(list(' '.join(list(context_1.values))))
     
-    if pickle_file_2:
-        df_2 = pickle.load(open(pickle_file_2, "rb"))
+    if checkpoint_dir_2:
+        df_2 = CheckpointStore(checkpoint_dir_2).load(['Error Context'])
         context_2 = df_2['Error Context'].str.replace(" ", "}")  # convert spaces to }
         chars_2 = set(list(casefold(' '.join(list(context_2.values)))))  # casefold
         all_chars = chars_2.union(all_chars)    
@@ -1,13 +1,12 @@
 # coding=utf-8
 from __future__ import division
 import numpy as np
+import pandas as pd
+from collections import Counter
 import helper_functions as helper
-import logging
+import log_config
 
-logger = logging.getLogger('keyboard_distance')
-logger.setLevel(logging.DEBUG)
-fh = logging.FileHandler('keyboard_distance.log')
-logger.addHandler(fh)
+logger = log_config.get_logger('keyboard_distance')
 
 # QWERTY Keyboard Map for US English
 #
@@ -49,12 +48,24 @@ logger.addHandler(fh)
 #  -Chinese, Greek, Cyrillic characters
 
 
+# Characters with diacritics whose normalized keys are looked up when the keyboard is built,
+# i.e. Latin-1 Supplement and Latin Extended-A/B. Other characters are normalized on first use.
+DIACRITIC_RANGE = range(0xC0, 0x250)
+
+
 class KeyboardDistance:
     def __init__(self, language="english"):
         self.language = language
         self.qwerty_grid = None
         self.QWERTY_grid = None
         self.average_x, self.average_y = None, None
+        self.key_locations = {}  # character on the keyboard -> (row, column)
+        self.locations = {}  # any character -> (character after normalization, (row, column) or None)
+        self.hands = {}  # any character -> hand used to type it, see get_hand
+        self.alphabet = []  # characters on the keyboard, in the order of the distance matrix
+        self.alphabet_index = {}  # any character -> row/column in the distance matrix
+        self.distance_matrix = None  # last row/column is for characters that are not on the keyboard
+        self.lookups = Counter()  # characters looked up by char_indices, see cache_stats
         self.initialize(language)
 
     def initialize(self, language):
@@ -90,35 +101,121 @@ class KeyboardDistance:
             raise ValueError('The language ' + language + ' is not supported yet!')
 
         self.average_x, self.average_y = self.qwerty_grid.shape[1]/2, self.qwerty_grid.shape[0]/2
-        logger.debug("Average locations are : " + str(self.average_x) + ", " + str(self.average_y))
+        logger.debug("Average locations are : %s, %s", self.average_x, self.average_y)
+        self.build_lookup_tables()
 
-    def get_location(self, first_char, second_char):
+    def build_lookup_tables(self):
+        # Same search order as np.where: lower case map first, then upper case map, row by row.
+        # Empty cells hold the string 'None' after the conversion to a unicode matrix.
+        self.key_locations = {}
+        for grid in (self.qwerty_grid, self.QWERTY_grid):
+            for row, keys in enumerate(grid.tolist()):
+                for column, key in enumerate(keys):
+                    if key != u'None' and key not in self.key_locations:
+                        self.key_locations[key] = (row, column)
+        self.locations = {}
+        self.hands = {}
+        for char in list(self.key_locations) + [unichr(code) for code in DIACRITIC_RANGE]:
+            self.find_key(char)
+            self.get_hand(char)
+        self.build_distance_matrix()
+
+    def build_distance_matrix(self):
+        # distance between every pair of keys, computed the same way as calculate_distance
+        self.alphabet = sorted(self.key_locations)
+        self.alphabet_index = dict((char, index) for index, char in enumerate(self.alphabet))
+        rows = np.array([self.key_locations[char][0] for char in self.alphabet])
+        columns = np.array([self.key_locations[char][1] for char in self.alphabet])
+        is_space = np.array([char == ' ' for char in self.alphabet])
+
+        # Handle spacebar case
+        first_columns = np.where(is_space[:, None], np.clip(columns[None, :], 3, 7), columns[:, None])
+        second_columns = np.where(is_space[None, :], np.clip(first_columns, 3, 7), columns[None, :])
+        x = rows[:, None] - rows[None, :]
+        y = first_columns - second_columns
+
+        size = len(self.alphabet) + 1
+        self.distance_matrix = np.empty((size, size))
+        self.distance_matrix[:-1, :-1] = self.offset_distances(x, y)
+        np.fill_diagonal(self.distance_matrix[:-1, :-1], 0)  # same character
+        # characters that are not on the map are at the average location
+        self.distance_matrix[-1, :] = self.offset_distance(self.average_x, self.average_y)
+        self.distance_matrix[:, -1] = self.distance_matrix[-1, -1]
+
+    @staticmethod
+    def offset_distances(x, y):
+        orthogonal = ((x == 0) & (np.abs(y) <= 1)) | ((np.abs(x) <= 1) & (y == 0))
+        diagonal = ((x == -1) & (y == 1)) | ((x == 1) & (y == -1))
+        return np.where((x == 0) & (y == 0), 0, np.where(orthogonal | diagonal, 1, np.sqrt(np.square(x)+np.square(y))))
+
+    @staticmethod
+    def offset_distance(x, y):
+        if x == 0 and y == 0:
+            logger.debug("same")
+            dist = 0
+        elif (x == 0 and (np.abs(y) <= 1)) or (np.abs(x) <= 1 and y == 0):
+            logger.debug("orthogonal")
+            dist = 1
+        elif (x == -1 and y == 1) or (x == 1 and y == -1):
+            logger.debug("diagonal")
+            dist = 1
+        else:
+            logger.debug("other")
+            dist = np.sqrt(np.square(x)+np.square(y))
+        return dist
+
+    def char_index(self, char):
+        if char not in self.alphabet_index:
+            self.lookups['misses'] += 1
+            normalized, location = self.find_key(char)
+            if location is None:
+                self.alphabet_index[char] = len(self.alphabet)
+            else:
+                self.alphabet_index[char] = self.alphabet_index[normalized]
+        return self.alphabet_index[char]
+
+    def char_indices(self, chars):
+        codes, uniques = pd.factorize(np.asarray(chars, dtype=object))
+        self.lookups['chars'] += len(codes)
+        self.lookups['distinct'] += len(uniques)
+        return np.array([self.char_index(char) for char in uniques], dtype=np.intp)[codes]
+
+    def distances(self, first_chars, second_chars):
+        # vectorized calculate_distance for arrays or Series of characters
+        first_chars = np.asarray(first_chars, dtype=object)
+        second_chars = np.asarray(second_chars, dtype=object)
+        dist = self.distance_matrix[self.char_indices(first_chars), self.char_indices(second_chars)]
+        dist[first_chars == second_chars] = 0
+        return dist
+
+    def cache_stats(self):
+        # distinct characters of each char_indices call are looked up once, misses are new to alphabet_index
+        return {'chars': self.lookups['chars'], 'distinct': self.lookups['distinct'],
+                'hits': self.lookups['distinct'] - self.lookups['misses'], 'misses': self.lookups['misses']}
+
+    def find_key(self, char):
         # only normalize if character doesn't exist in keyboard
-        if first_char not in self.qwerty_grid and first_char not in self.QWERTY_grid:
-            first_char = helper.normalize(first_char)
-        if second_char not in self.qwerty_grid and second_char not in self.QWERTY_grid:
-            second_char = helper.normalize(second_char)
-
-        loc1 = np.where(self.qwerty_grid == first_char)
-        # if we can't find it, look in other map
-        if len(loc1[0]) == 0:
-            loc1 = np.where(self.QWERTY_grid == first_char)
-        # still can't find it, just return average
-        if len(loc1[0]) == 0:
-            logger.debug("Couldn't find first character " + first_char + " so returning average locations")
+        if char not in self.locations:
+            if char in self.key_locations:
+                self.locations[char] = (char, self.key_locations[char])
+            else:
+                normalized = helper.normalize(char)
+                self.locations[char] = (normalized, self.key_locations.get(normalized))
+        return self.locations[char]
+
+    def get_location(self, first_char, second_char):
+        first_char, loc1 = self.find_key(first_char)
+        # can't find it, just return average
+        if loc1 is None:
+            logger.debug("Couldn't find first character %s so returning average locations", first_char)
             return self.average_x, self.average_y
-        loc1_row = loc1[0][0]
-        loc1_column = loc1[1][0]
-        loc2 = np.where(self.qwerty_grid == second_char)
-        # if we can't find it, look in other map
-        if len(loc2[0]) == 0:
-            loc2 = np.where(self.QWERTY_grid == second_char)
-        # still can't find it, just return average
-        if len(loc2[0]) == 0:
-            logger.debug("Couldn't find second character " + second_char + " so returning average locations")
+        loc1_row, loc1_column = loc1
+        second_char, loc2 = self.find_key(second_char)
+        # can't find it, just return average
+        if loc2 is None:
+            logger.debug("Couldn't find second character %s so returning average locations", second_char)
             return self.average_x, self.average_y
-        loc2_row = loc2[0][0]
-        loc2_column = loc2[1][0]
+        loc2_row, loc2_column = loc2
 
         # Handle spacebar case
         if first_char == ' ':
@@ -141,47 +238,31 @@ class KeyboardDistance:
         return x, y
 
     def calculate_distance(self, first_char, second_char):
-        logger.debug("calculate distance for %s; %s" % (first_char, second_char))
+        logger.debug("calculate distance for %s; %s", first_char, second_char)
         if first_char == second_char:
             logger.debug("same")
             dist = 0
         else:
             x, y = self.get_location(first_char, second_char)
-            if x == 0 and y == 0:
-                logger.debug("same")
-                dist = 0
-            elif (x == 0 and (np.abs(y) <= 1)) or (np.abs(x) <= 1 and y == 0):
-                logger.debug("orthogonal")
-                dist = 1
-            elif (x == -1 and y == 1) or (x == 1 and y == -1):
-                logger.debug("diagonal")
-                dist = 1
-            else:
-                logger.debug("other")
-                dist = np.sqrt(np.square(x)+np.square(y))
+            dist = self.offset_distance(x, y)
         return dist
 
     def get_hand(self, char):
-        char = helper.normalize(char)
-        loc = np.where(self.qwerty_grid == char)
-        # if we can't find it, look in other map
-        if len(loc[0]) == 0:
-            loc = np.where(self.QWERTY_grid == char)
-        # still can't find it, just return none
-        if len(loc[0]) == 0:
-            logger.debug("Couldn't find  character " + char + " so returning none")
-            return None
-        loc_row = loc[0][0]
-        loc_column = loc[1][0]
-
-        # special case for spacebar, can be typed with either hand
-        if loc_row == 4:
-            return 's'
-        else:
-            if loc_column <= 5:
-                return 'l'
+        if char not in self.hands:
+            loc = self.key_locations.get(helper.normalize(char))
+            # can't find it, just return none
+            if loc is None:
+                logger.debug("Couldn't find  character %s so returning none", char)
+                hand = None
+            # special case for spacebar, can be typed with either hand
+            elif loc[0] == 4:
+                hand = 's'
+            elif loc[1] <= 5:
+                hand = 'l'
             else:
-                return 'r'
+                hand = 'r'
+            self.hands[char] = hand
+        return self.hands[char]
 
     def same_hand(self, first_char, second_char):
         hand_first = self.get_hand(first_char)
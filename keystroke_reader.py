@@ -0,0 +1,69 @@
+import csv
+import os
+import pandas
+
+# Streaming input for ErrorAligner.parse_errors. Keystroke logs are read one row at a
+# time, so memory doesn't grow with the size of the study. Rows are lists of cell values
+# in the column layout of the keystroke logs:
+#   0 time, 1 key, 2 response id, 3 (unused), 4 participant id, 5 sentence id, 6 sentence text
+# The header row is skipped, like pandas.ExcelFile.parse does.
+
+FORMATS = ('xlsx', 'csv', 'tsv', 'excel')
+
+
+def guess_format(file_name):
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension in ('.xlsx', '.xlsm'):
+        return 'xlsx'
+    elif extension == '.csv':
+        return 'csv'
+    elif extension in ('.tsv', '.txt'):
+        return 'tsv'
+    else:
+        # e.g. old .xls files, which openpyxl can't stream
+        return 'excel'
+
+
+def read_keystrokes(file_name, file_format=None):
+    if file_format is None:
+        file_format = guess_format(file_name)
+    if file_format == 'xlsx':
+        rows = read_xlsx(file_name)
+    elif file_format == 'csv':
+        rows = read_delimited(file_name, ',', csv.QUOTE_MINIMAL)
+    elif file_format == 'tsv':
+        rows = read_delimited(file_name, '\t', csv.QUOTE_NONE)
+    elif file_format == 'excel':
+        rows = read_excel(file_name)
+    else:
+        raise ValueError('The keystroke file format ' + file_format + ' is not supported yet!')
+
+    header = True
+    for row in rows:
+        if header:
+            header = False
+        elif any(cell is not None for cell in row):  # pandas drops blank rows too
+            yield row
+
+
+def read_xlsx(file_name):
+    import openpyxl
+    workbook = openpyxl.load_workbook(file_name, read_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows():
+            yield [cell.value for cell in row]
+    finally:
+        workbook.close()
+
+
+def read_delimited(file_name, delimiter, quoting):
+    with open(file_name, 'rb') as f:
+        for line in csv.reader(f, delimiter=delimiter, quoting=quoting):
+            yield [unicode(cell, 'utf-8') for cell in line]
+
+
+def read_excel(file_name):
+    f = pandas.ExcelFile(file_name)
+    df = f.parse(f.sheet_names[0], header=None)
+    for row in df.itertuples(index=False):
+        yield list(row)
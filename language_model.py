@@ -0,0 +1,276 @@
+from __future__ import division
+import csv
+import io
+import log_config
+import os
+import sys
+import numpy as np
+from checkpoint import file_digest
+
+logger = log_config.get_logger('language_model')
+
+MAX_ORDER = 5
+TOKEN_BITS = 12  # MAX_ORDER * TOKEN_BITS bits have to fit in an int64 key
+MAX_VOCABULARY = 2 ** TOKEN_BITS - 1  # code 0 is never used
+COMPACT_SUFFIX = '.compact'
+DIGEST_FILE = 'arpa.sha1'  # digest of the ARPA file a compact model was converted from
+
+# default models of the supported languages
+LM_FILES = {'english': os.path.join('resources', 'EnglishEuroparl.chars_parkinsons_casefolded.lm'),
+            'spanish': os.path.join('resources', 'SpanishEuroparl-noShift.lm')}
+
+
+def compact_path(lm_file):
+    return lm_file + COMPACT_SUFFIX
+
+
+def as_float(value):
+    # The ARPA file has 7 significant digits, which survive the float32 round trip, so
+    # going through the shortest float32 repr gives back the number in the ARPA file.
+    return float(repr(np.float32(value)))
+
+
+def as_text(value):
+    # the number as the ARPA file writes it, with %g: '-1' and '0', not '-1.0' and '0.0'
+    text = repr(as_float(value))
+    return text[:-2] if text.endswith('.0') else text
+
+
+class CharLanguageModel:
+    """
+      Character n-gram language model from a SriLM ARPA file, stored compactly. Every token
+      (character, '}' for space, '<s>', '</s>') is interned to an integer code and every n-gram
+      is packed into one int64 key. For each order there is a sorted array of keys, with
+      float32 arrays of log probabilities and backoff weights (0 if the ARPA file has none).
+      The arrays are converted once and saved next to the ARPA file, so that later runs can
+      memory-map them instead of parsing the ARPA file again.
+    """
+
+    def __init__(self, vocabulary, keys, log_probs, backoffs, path=None):
+        """
+        Constructor.
+        :param
+            vocabulary: list of tokens, the code of a token is its index + 1.
+            keys, log_probs, backoffs: dicts from order to arrays of the same length.
+        """
+        self.vocabulary = vocabulary
+        self.codes = dict((token, code) for code, token in enumerate(vocabulary, 1))
+        self.keys = keys
+        self.log_probs = log_probs
+        self.backoffs = backoffs
+        self.path = path
+
+    @classmethod
+    def open(cls, lm_file):
+        # load the compact model if it was converted from this ARPA file, otherwise convert the ARPA file.
+        # The digest is compared rather than the times, as a replaced file can be older than the conversion.
+        directory = compact_path(lm_file)
+        digest_file = os.path.join(directory, DIGEST_FILE)
+        if not os.path.exists(lm_file):
+            digest = None
+            up_to_date = os.path.exists(os.path.join(directory, 'vocabulary.txt'))
+        else:
+            digest = file_digest(lm_file)
+            up_to_date = False
+            if os.path.exists(digest_file):
+                with io.open(digest_file, encoding='ascii') as f:
+                    up_to_date = f.read().strip() == digest
+        if up_to_date:
+            model = cls.load(directory)
+        else:
+            model = cls.from_arpa(lm_file)
+            try:
+                model.save(directory, digest)
+            except (IOError, OSError) as e:
+                logger.warning('Could not save compact language model to ' + directory + ': ' + str(e))
+        model.path = lm_file
+        return model
+
+    @classmethod
+    def from_arpa(cls, lm_file):
+        # one tab separated section per order, as written by SriLM
+        codes = {}
+        vocabulary = []
+        entries = {}  # order -> (keys, log probs, backoffs), in file order
+        ngram_match = "-grams:"
+        index = 0
+        with open(lm_file) as f:
+            for line in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+                if len(line) == 0:
+                    continue
+                elif line[0].endswith(ngram_match):
+                    index += 1
+                    if index > MAX_ORDER:
+                        raise ValueError('Only n-grams up to order ' + str(MAX_ORDER) + ' are supported')
+                    entries[index] = ([], [], [])
+                elif len(line) < 2 or index == 0:
+                    continue
+                else:
+                    key = 0
+                    for token in unicode(line[1], 'utf-8').split(' '):
+                        if token not in codes:
+                            vocabulary.append(token)
+                            codes[token] = len(vocabulary)
+                            if len(vocabulary) > MAX_VOCABULARY:
+                                raise ValueError('Vocabulary of ' + lm_file + ' is too large')
+                        key = (key << TOKEN_BITS) | codes[token]
+                    keys, log_probs, backoffs = entries[index]
+                    keys.append(key)
+                    log_probs.append(float(line[0]))
+                    # sometimes we don't have backoff weight
+                    backoffs.append(float(line[2]) if len(line) > 2 else 0.0)
+
+        model_keys, model_log_probs, model_backoffs = {}, {}, {}
+        for order, (keys, log_probs, backoffs) in entries.items():
+            keys = np.array(keys, dtype=np.int64)
+            # sort by key, and keep the last entry of repeated n-grams like a dict would
+            order_index = np.argsort(keys[::-1], kind='mergesort')
+            order_index = len(keys) - 1 - order_index
+            keys = keys[order_index]
+            unique = np.ones(len(keys), dtype=bool)
+            unique[1:] = keys[1:] != keys[:-1]
+            model_keys[order] = keys[unique]
+            model_log_probs[order] = np.array(log_probs, dtype=np.float32)[order_index][unique]
+            model_backoffs[order] = np.array(backoffs, dtype=np.float32)[order_index][unique]
+        return cls(vocabulary, model_keys, model_log_probs, model_backoffs, lm_file)
+
+    def save(self, directory, arpa_digest):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        digest_file = os.path.join(directory, DIGEST_FILE)
+        if os.path.exists(digest_file):
+            os.remove(digest_file)
+        for order in self.keys:
+            np.save(os.path.join(directory, '%d.keys.npy' % order), self.keys[order])
+            np.save(os.path.join(directory, '%d.logprob.npy' % order), self.log_probs[order])
+            np.save(os.path.join(directory, '%d.backoff.npy' % order), self.backoffs[order])
+        with io.open(os.path.join(directory, 'vocabulary.txt'), 'w', encoding='utf-8', newline='\n') as f:
+            f.write(u''.join(token + u'\n' for token in self.vocabulary))
+        # written last, so that an interrupted conversion isn't loaded
+        with io.open(digest_file, 'w', encoding='ascii') as f:
+            f.write(unicode(arpa_digest) + u'\n')
+
+    @classmethod
+    def load(cls, directory):
+        with io.open(os.path.join(directory, 'vocabulary.txt'), encoding='utf-8', newline='\n') as f:
+            vocabulary = [line[:-1] for line in f]
+        keys, log_probs, backoffs = {}, {}, {}
+        order = 1
+        while os.path.exists(os.path.join(directory, '%d.keys.npy' % order)):
+            keys[order] = np.load(os.path.join(directory, '%d.keys.npy' % order), mmap_mode='r')
+            log_probs[order] = np.load(os.path.join(directory, '%d.logprob.npy' % order), mmap_mode='r')
+            backoffs[order] = np.load(os.path.join(directory, '%d.backoff.npy' % order), mmap_mode='r')
+            order += 1
+        return cls(vocabulary, keys, log_probs, backoffs, directory)
+
+    def encode(self, string_lm, order):
+        # packed key of a space separated n-gram, None if it can't be in the model
+        tokens = string_lm.split(' ')
+        if len(tokens) != order or order not in self.keys:
+            return None
+        key = 0
+        for token in tokens:
+            code = self.codes.get(token)
+            if code is None:
+                return None
+            key = (key << TOKEN_BITS) | code
+        return key
+
+    def lookup(self, string_lm, order):
+        # index of the n-gram in the arrays of its order, None if it isn't in the model
+        key = self.encode(string_lm, order)
+        if key is None:
+            return None
+        keys = self.keys[order]
+        index = int(np.searchsorted(keys, key))
+        if index < len(keys) and keys[index] == key:
+            return index
+        return None
+
+    def __contains__(self, string_lm):
+        return self.lookup(string_lm, len(string_lm.split(' '))) is not None
+
+    def log_prob(self, order, index):
+        return as_float(self.log_probs[order][index])
+
+    def log_prob_text(self, order, index):
+        return as_text(self.log_probs[order][index])
+
+    def backoff(self, order, index):
+        return as_float(self.backoffs[order][index])
+
+    def lookup_many(self, strings_lm, orders):
+        # vectorized lookup, -1 where the n-gram isn't in the model
+        keys = [self.encode(string_lm, order) for string_lm, order in zip(strings_lm, orders)]
+        keys = np.array([-1 if key is None else key for key in keys], dtype=np.int64)
+        orders = np.asarray(orders, dtype=np.int64)
+        indices = np.empty(len(keys), dtype=np.int64)
+        indices.fill(-1)
+        for order in self.keys:
+            mask = (orders == order) & (keys >= 0)
+            if not mask.any():
+                continue
+            order_keys = self.keys[order]
+            found = np.minimum(np.searchsorted(order_keys, keys[mask]), len(order_keys) - 1)
+            indices[mask] = np.where(order_keys[found] == keys[mask], found, -1)
+        return indices
+
+    def log_prob_many(self, orders, indices):
+        return self.gather(self.log_probs, orders, indices)
+
+    def backoff_many(self, orders, indices):
+        return self.gather(self.backoffs, orders, indices)
+
+    @staticmethod
+    def gather(arrays, orders, indices):
+        values = np.zeros(len(indices), dtype=np.float32)
+        for order in np.unique(orders):
+            mask = orders == order
+            values[mask] = arrays[order][indices[mask]]
+        return np.array([as_float(value) for value in values], dtype=np.float64)
+
+
+class LanguageModelRegistry:
+    """
+      Keeps every language model a process has opened, keyed by the absolute path of its
+      ARPA file, so that several languages can be used side by side. Models are opened on
+      first use and their arrays are memory-mapped, so worker processes forked after a model
+      is opened share the same read-only pages.
+    """
+
+    def __init__(self, lm_files=None):
+        self.lm_files = dict(LM_FILES if lm_files is None else lm_files)
+        self.models = {}
+
+    def register(self, language, lm_file):
+        self.lm_files[language.lower()] = lm_file
+
+    def resolve(self, name):
+        # path of the ARPA file of a language name or path
+        lm_file = self.lm_files.get(name.lower(), name)
+        return os.path.abspath(lm_file)
+
+    def get(self, name):
+        lm_file = self.resolve(name)
+        if lm_file not in self.models:
+            logger.debug('Opening language model ' + lm_file)
+            self.models[lm_file] = CharLanguageModel.open(lm_file)
+        return self.models[lm_file]
+
+    def __contains__(self, name):
+        return self.resolve(name) in self.models
+
+    def clear(self):
+        self.models.clear()
+
+
+registry = LanguageModelRegistry()
+
+
+if __name__ == '__main__':
+    # one-time conversion of ARPA files to the compact format
+    if len(sys.argv) < 2:
+        print("FORMAT: lm_file [lm_file ...]")
+        sys.exit(1)
+    for lm_file in sys.argv[1:]:
+        CharLanguageModel.from_arpa(lm_file).save(compact_path(lm_file), file_digest(lm_file))
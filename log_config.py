@@ -0,0 +1,149 @@
+import atexit
+import logging
+import os
+import threading
+from Queue import Queue
+
+# Every module logs to its own <module name>.log file. Only warnings are logged by default,
+# because the debug messages of the feature extraction come several times per character
+# and writing them costs more than the features themselves. enable_debug_logging turns
+# them on, optionally writing the files from a background thread. The files are written to
+# the working directory, or to the one given to set_log_directory.
+
+DEFAULT_LEVEL = logging.WARNING
+
+loggers = []
+listener = None
+log_directory = None
+
+
+def get_logger(name):
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        logger.setLevel(DEFAULT_LEVEL)
+        # the file is only created once something is logged
+        logger.addHandler(logging.FileHandler(log_file(name), delay=True))
+        loggers.append(logger)
+    return logger
+
+
+def log_file(name):
+    if log_directory is None:
+        return name + '.log'
+    return os.path.join(log_directory, name + '.log')
+
+
+def set_log_directory(directory):
+    # writes the log files of all loggers, also the existing ones, to directory (None: the working directory)
+    global log_directory
+    log_directory = directory
+    for logger in loggers:
+        for handler in logger.handlers[:]:
+            if isinstance(handler, QueueHandler):
+                handler.target = moved_handler(handler.target, logger.name)
+            elif isinstance(handler, logging.FileHandler):
+                logger.removeHandler(handler)
+                logger.addHandler(moved_handler(handler, logger.name))
+
+
+def moved_handler(handler, name):
+    if not isinstance(handler, logging.FileHandler):
+        return handler
+    handler.close()
+    return logging.FileHandler(log_file(name), delay=True)
+
+
+def enable_debug_logging(asynchronous=False):
+    global listener
+    for logger in loggers:
+        logger.setLevel(logging.DEBUG)
+    if asynchronous and listener is None:
+        listener = QueueListener()
+        for logger in loggers:
+            handlers = logger.handlers[:]
+            for handler in handlers:
+                logger.removeHandler(handler)
+                logger.addHandler(QueueHandler(listener.queue, handler))
+        listener.start()
+        atexit.register(disable_debug_logging)
+
+
+def disable_debug_logging():
+    global listener
+    for logger in loggers:
+        logger.setLevel(DEFAULT_LEVEL)
+    if listener is not None:
+        listener.stop()
+        for logger in loggers:
+            for handler in logger.handlers[:]:
+                if isinstance(handler, QueueHandler):
+                    logger.removeHandler(handler)
+                    logger.addHandler(handler.target)
+        listener = None
+
+
+def after_fork():
+    # the listener thread of the parent doesn't run in a forked process, whose records would
+    # stay on its copy of the queue, so they are written to the files directly instead
+    global listener
+    if listener is None:
+        return
+    for logger in loggers:
+        for handler in logger.handlers[:]:
+            if isinstance(handler, QueueHandler):
+                logger.removeHandler(handler)
+                logger.addHandler(handler.target)
+    listener = None
+
+
+class QueueHandler(logging.Handler):
+    """
+      Puts records on a queue for a QueueListener, which hands them to the target handler.
+      (logging.handlers only has a QueueHandler from Python 3.2 on.)
+    """
+
+    def __init__(self, queue, target):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.target = target
+
+    def emit(self, record):
+        try:
+            # the message is formatted now, as its arguments may change before it is written
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.queue.put((self.target, record))
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener:
+    """
+      Background thread that writes the records of QueueHandlers until it is stopped.
+    """
+
+    def __init__(self):
+        self.queue = Queue()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            handler, record = item
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def stop(self):
+        # writes everything that is still queued
+        self.queue.put(None)
+        self.thread.join()
@@ -0,0 +1,301 @@
+from __future__ import division
+import numpy as np
+
+# Needleman Wunsch engines shared by alignment.py and alignment-outputbycharacter.py.
+# Every engine returns the alignment in traceback order (i.e., reversed), which is
+# what ErrorAligner.outputforanalysis expects, and every engine breaks ties the same
+# way: diagonal first, then a gap in seq2 ('^' in align2), then a gap in seq1.
+
+MATCH_AWARD = 1
+MISMATCH_PENALTY = -1
+GAP_PENALTY = -2  # both for insertion and deletion
+
+BAND_WIDTH = 8  # initial half width of the band for the banded engine
+NEGATIVE_INFINITY = -2 ** 30  # score of cells outside the band
+
+# traceback pointers for the numpy engine
+TRACE_DIAGONAL = 0
+TRACE_LEFT = 1  # consume a character of seq1 only
+TRACE_UP = 2  # consume a character of seq2 only
+
+
+def match_score(alpha, beta, gap_penalty=GAP_PENALTY):
+    if alpha == beta:
+        return MATCH_AWARD
+    elif alpha == '^' or beta == '^':
+        return gap_penalty
+    else:
+        return MISMATCH_PENALTY
+
+
+# zeros() was originally from NumPy.
+# This version is implemented by alevchuk 2011-04-10
+def zeros(shape):
+    retval = []
+    for x in range(shape[0]):
+        retval.append([])
+        for y in range(shape[1]):
+            retval[-1].append(0)
+    return retval
+
+
+# The function align_python is adapted from the following :
+# https://github.com/alevchuk/pairwise-alignment-in-python
+def align_python(seq1, seq2, gap_penalty=GAP_PENALTY):
+    m, n = len(seq1), len(seq2)  # length of two sequences
+
+    # Generate DP table and traceback path pointer matrix
+    score = zeros((m + 1, n + 1))  # the DP table
+
+    # Calculate DP table
+    for i in range(0, m + 1):
+        score[i][0] = gap_penalty * i
+    for j in range(0, n + 1):
+        score[0][j] = gap_penalty * j
+    for i in range(1, m + 1):
+        for j in range(1, n + 1):
+            match = score[i - 1][j - 1] + match_score(seq1[i - 1], seq2[j - 1], gap_penalty)
+            delete = score[i - 1][j] + gap_penalty
+            insert = score[i][j - 1] + gap_penalty
+            score[i][j] = max(match, delete, insert)
+
+    # Traceback and compute the alignment
+    align1, align2 = '', ''
+    i, j = m, n  # start from the bottom right cell
+    while i > 0 and j > 0:  # end touching the top or the left edge
+        score_current = score[i][j]
+        score_diagonal = score[i - 1][j - 1]
+        score_up = score[i][j - 1]
+        score_left = score[i - 1][j]
+
+        if score_current == score_diagonal + match_score(seq1[i - 1], seq2[j - 1], gap_penalty):
+            align1 += seq1[i - 1]
+            align2 += seq2[j - 1]
+            i -= 1
+            j -= 1
+        elif score_current == score_left + gap_penalty:
+            align1 += seq1[i - 1]
+            align2 += '^'
+            i -= 1
+        elif score_current == score_up + gap_penalty:
+            align1 += '^'
+            align2 += seq2[j - 1]
+            j -= 1
+
+    # Finish tracing up to the top left cell
+    while i > 0:
+        align1 += seq1[i - 1]
+        align2 += '^'
+        i -= 1
+    while j > 0:
+        align1 += '^'
+        align2 += seq2[j - 1]
+        j -= 1
+    return align1, align2
+
+
+def to_codes(seq):
+    return np.fromiter((ord(char) for char in seq), dtype=np.int32, count=len(seq))
+
+
+def match_row(char_code, codes2, is_gap2, gap_penalty=GAP_PENALTY):
+    # vectorized match_score of one character of seq1 against all of seq2
+    scores = np.where(is_gap2 | (char_code == ord('^')), gap_penalty, MISMATCH_PENALTY)
+    scores[codes2 == char_code] = MATCH_AWARD
+    return scores
+
+
+def traceback(pointers, seq1, seq2):
+    # follow the pointers from the bottom right cell, same order as align_python
+    align1, align2 = [], []
+    i, j = len(seq1), len(seq2)
+    while i > 0 and j > 0:
+        pointer = pointers[i - 1][j - 1]
+        if pointer == TRACE_DIAGONAL:
+            align1.append(seq1[i - 1])
+            align2.append(seq2[j - 1])
+            i -= 1
+            j -= 1
+        elif pointer == TRACE_LEFT:
+            align1.append(seq1[i - 1])
+            align2.append('^')
+            i -= 1
+        else:
+            align1.append('^')
+            align2.append(seq2[j - 1])
+            j -= 1
+    while i > 0:
+        align1.append(seq1[i - 1])
+        align2.append('^')
+        i -= 1
+    while j > 0:
+        align1.append('^')
+        align2.append(seq2[j - 1])
+        j -= 1
+    return u''.join(align1), u''.join(align2)
+
+
+def align_numpy(seq1, seq2, gap_penalty=GAP_PENALTY):
+    # Same recurrence as align_python, but each row of the DP table is computed with
+    # numpy and only the previous row is kept. The insertions within a row form a
+    # running maximum: score[i][j] = max_k(best[k] + gap*(j-k)), which is
+    # gap*j + maximum.accumulate(best[k] - gap*k).
+    m, n = len(seq1), len(seq2)
+    codes1, codes2 = to_codes(seq1), to_codes(seq2)
+    is_gap2 = codes2 == ord('^')
+    gaps = gap_penalty * np.arange(1, n + 1, dtype=np.int32)
+
+    pointers = np.empty((m, n), dtype=np.int8)
+    previous = gap_penalty * np.arange(0, n + 1, dtype=np.int32)
+    current = np.empty(n + 1, dtype=np.int32)
+    for i in range(1, m + 1):
+        diagonal = previous[:-1] + match_row(codes1[i - 1], codes2, is_gap2, gap_penalty)
+        left = previous[1:] + gap_penalty
+        best = np.maximum(diagonal, left)
+        current[0] = gap_penalty * i
+        current[1:] = np.maximum(np.maximum.accumulate(best - gaps) + gaps, current[0] + gaps)
+
+        row = pointers[i - 1]
+        row.fill(TRACE_UP)
+        row[current[1:] == left] = TRACE_LEFT
+        row[current[1:] == diagonal] = TRACE_DIAGONAL
+        previous, current = current, previous
+    return traceback(pointers, seq1, seq2)
+
+
+def banded_scores(seq1, seq2, gap_penalty, band):
+    # Fill only the cells with low <= j - i <= high, where the band is widened by the
+    # length difference so that it always contains the bottom right cell. Cell (i, j) is
+    # stored in column j - i - low of its row, so the diagonal predecessor is in the same
+    # column of the previous row and the left predecessor (i-1, j) in the next column.
+    m, n = len(seq1), len(seq2)
+    low = min(0, n - m) - band
+    high = max(0, n - m) + band
+    width = high - low + 1
+    codes1, codes2 = to_codes(seq1), to_codes(seq2)
+    is_gap2 = codes2 == ord('^')
+
+    # one extra column that stays at -infinity so that left lookups never go out of range
+    scores = np.empty((m + 1, width + 1), dtype=np.int32)
+    scores.fill(NEGATIVE_INFINITY)
+    exact = np.zeros((m + 1, width + 1), dtype=bool)
+    offsets = np.arange(low, high + 1, dtype=np.int32)
+    gaps = gap_penalty * np.arange(1, width + 1, dtype=np.int32)
+
+    # A path that leaves the band has to reach offset high+1 or low-1, so it has at least
+    # min_gaps gaps. Its score is at most (i+j-min_gaps)//2 matches plus the gaps, and a
+    # banded score at least that high can't be beaten from outside the band.
+    min_gaps = np.minimum(2 * (high + 1) - offsets, offsets - 2 * (low - 1))
+    gap_bound = min_gaps * gap_penalty
+
+    last = min(n, high)
+    scores[0, -low:last - low + 1] = gap_penalty * np.arange(0, last + 1)
+    exact[0, -low:last - low + 1] = True
+    for i in range(1, m + 1):
+        first, last = max(0, i + low), min(n, i + high)
+        if first == 0:
+            scores[i, -i - low] = gap_penalty * i
+            exact[i, -i - low] = True
+            first = 1
+        if first > last:
+            continue
+        start, stop = first - i - low, last - i - low + 1
+        count = stop - start
+        previous, current = scores[i - 1], scores[i]
+        diagonal = previous[start:stop] + match_row(codes1[i - 1], codes2[first - 1:last], is_gap2[first - 1:last],
+                                                     gap_penalty)
+        left = previous[start + 1:stop + 1] + gap_penalty
+        best = np.maximum(diagonal, left)
+        carry = current[start - 1] if start > 0 else NEGATIVE_INFINITY
+        current[start:stop] = np.maximum(np.maximum.accumulate(best - gaps[:count]) + gaps[:count],
+                                         carry + gaps[:count])
+        bound = (2 * i + offsets[start:stop] - min_gaps[start:stop]) // 2 * MATCH_AWARD + gap_bound[start:stop]
+        exact[i, start:stop] = current[start:stop] >= bound
+    return scores, exact, low, high
+
+
+def banded_traceback(scores, exact, low, high, seq1, seq2, gap_penalty):
+    # Same traceback as align_python. Returns None as soon as it needs a cell that is
+    # outside the band or whose score might differ from the full DP table.
+    def value(i, j):
+        if i == 0:
+            return gap_penalty * j
+        elif j == 0:
+            return gap_penalty * i
+        elif not low <= j - i <= high or not exact[i, j - i - low]:
+            return None
+        return int(scores[i, j - i - low])
+
+    align1, align2 = [], []
+    i, j = len(seq1), len(seq2)
+    while i > 0 and j > 0:
+        score_current = value(i, j)
+        score_diagonal = value(i - 1, j - 1)
+        if score_current is None or score_diagonal is None:
+            return None
+        if score_current == score_diagonal + match_score(seq1[i - 1], seq2[j - 1], gap_penalty):
+            align1.append(seq1[i - 1])
+            align2.append(seq2[j - 1])
+            i -= 1
+            j -= 1
+            continue
+        score_left = value(i - 1, j)
+        if score_left is None:
+            return None
+        if score_current == score_left + gap_penalty:
+            align1.append(seq1[i - 1])
+            align2.append('^')
+            i -= 1
+        else:
+            align1.append('^')
+            align2.append(seq2[j - 1])
+            j -= 1
+    while i > 0:
+        align1.append(seq1[i - 1])
+        align2.append('^')
+        i -= 1
+    while j > 0:
+        align1.append('^')
+        align2.append(seq2[j - 1])
+        j -= 1
+    return u''.join(align1), u''.join(align2)
+
+
+def align_banded(seq1, seq2, gap_penalty=GAP_PENALTY, band=BAND_WIDTH):
+    # Typed sentences are usually close to the intended ones, so the optimal path stays
+    # near the diagonal. Double the band until the traceback can be proven to match the
+    # full DP table. The band keeps a score and a flag (5 bytes) for each of its
+    # (m + 1) * (width + 1) cells, where align_numpy keeps a 1 byte pointer for each of the
+    # m * n cells, so align_numpy is used as soon as the band wouldn't be smaller. This
+    # saves memory on long sentences of similar length, but no time: every doubling
+    # recomputes the whole band, so it is no faster than align_numpy.
+    m, n = len(seq1), len(seq2)
+    if 2 * gap_penalty >= -MATCH_AWARD:
+        # gaps are too cheap to bound the score of paths outside the band
+        return align_numpy(seq1, seq2, gap_penalty)
+    while banded_size(m, n, band) < (m + 1) * (n + 1):
+        scores, exact, low, high = banded_scores(seq1, seq2, gap_penalty, band)
+        alignment = banded_traceback(scores, exact, low, high, seq1, seq2, gap_penalty)
+        if alignment is not None:
+            return alignment
+        band *= 2
+    return align_numpy(seq1, seq2, gap_penalty)
+
+
+def banded_size(m, n, band):
+    # bytes of the scores and exact arrays of banded_scores
+    width = abs(n - m) + 2 * band + 1
+    return (m + 1) * (width + 1) * (np.dtype(np.int32).itemsize + np.dtype(bool).itemsize)
+
+
+ENGINES = {'python': align_python, 'numpy': align_numpy, 'banded': align_banded}
+
+
+def get_engine(engine):
+    if engine not in ENGINES:
+        raise ValueError('The alignment engine ' + engine + ' is not supported yet!')
+    return ENGINES[engine]
+
+
+def align(seq1, seq2, gap_penalty=GAP_PENALTY, engine='python'):
+    return get_engine(engine)(seq1, seq2, gap_penalty)
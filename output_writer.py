@@ -0,0 +1,98 @@
+import gzip
+import io
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024  # bytes
+DEFAULT_BATCH_SIZE = 1000  # records written per flush
+COMPRESSIONS = ('gzip', 'zstd')
+
+
+def guess_compression(file_name):
+    if file_name.endswith('.gz'):
+        return 'gzip'
+    elif file_name.endswith('.zst'):
+        return 'zstd'
+    else:
+        return None
+
+
+class OutputWriter:
+    """
+      Keeps a single utf-8 output stream open for a whole run. Records are collected and
+      written in batches through a large write buffer, optionally compressed with gzip or
+      zstd (which needs the zstandard package).
+    """
+
+    def __init__(self, file_name, buffer_size=DEFAULT_BUFFER_SIZE, batch_size=DEFAULT_BATCH_SIZE, compression=None):
+        """
+        Constructor.
+        :param
+            file_name: file to write to, truncated when opened.
+            compression: None, 'gzip' or 'zstd'. If None, it is guessed from the file extension (.gz or .zst).
+        """
+        self.file_name = file_name
+        self.batch_size = batch_size
+        self.pending = []
+        if compression is None:
+            compression = guess_compression(file_name)
+        if compression not in (None,) + COMPRESSIONS:
+            raise ValueError('The compression ' + compression + ' is not supported yet!')
+        if compression == 'zstd':
+            # checked before the file is opened, so that a missing package doesn't leave an empty file behind
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError('Writing ' + file_name + ' with zstd needs the zstandard package, '
+                                  'install it or use gzip instead')
+        self.raw = io.open(file_name, 'wb', buffering=buffer_size)
+        self.handle = self.raw
+        if compression == 'zstd':
+            self.handle = zstandard.ZstdCompressor().stream_writer(self.raw)
+        elif compression == 'gzip':
+            self.handle = gzip.GzipFile(fileobj=self.raw, mode='wb')
+        self.compression = compression
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, text):
+        self.pending.append(text)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def writelines(self, lines):
+        self.pending.extend(lines)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.handle.write(u''.join(self.pending).encode('utf-8'))
+            self.pending = []
+
+    def close(self):
+        if self.raw.closed:
+            return
+        self.flush()
+        if self.handle is not self.raw:
+            self.handle.close()
+        if not self.raw.closed:
+            self.raw.close()
+
+
+class LineBuffer:
+    """
+      Stands in for an OutputWriter in worker processes and keeps the records in memory,
+      so that the parent process can write them in the original order.
+    """
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        self.lines.append(text)
+
+    def writelines(self, lines):
+        self.lines.extend(lines)
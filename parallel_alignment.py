@@ -0,0 +1,47 @@
+import itertools
+import multiprocessing
+import profiling
+from output_writer import LineBuffer
+
+# Sentence-parallel alignment for ErrorAligner (alignment.py and alignment-outputbycharacter.py).
+# Every sentence is aligned independently, so batches of sentences are aligned in a process
+# pool and the output records are written by the parent in the order of the keystroke log,
+# which gives the same output file as a serial run. The profiling sections of the workers come
+# back with their records.
+
+SENTENCES_PER_WORKER = 64  # sentences per worker in each batch read from the keystroke log
+
+worker_aligner = None
+
+
+def init_worker(aligner):
+    global worker_aligner
+    profiling.after_fork()
+    worker_aligner = aligner
+
+
+def align_sentence(sentence):
+    worker_aligner.out = LineBuffer()
+    worker_aligner.needle(*sentence)
+    return worker_aligner.out.lines, profiling.take_sections()
+
+
+def align_sentences(aligner, sentences, workers, sentences_per_worker=SENTENCES_PER_WORKER):
+    # only one batch of sentences is in memory at a time
+    batch_size = workers * sentences_per_worker
+    chunk_size = max(1, sentences_per_worker // 4)
+    pool = multiprocessing.Pool(workers, init_worker, (aligner,))
+    try:
+        while True:
+            batch = list(itertools.islice(sentences, batch_size))
+            if not batch:
+                break
+            for lines, sections in pool.imap(align_sentence, batch, chunk_size):
+                aligner.out.writelines(lines)
+                profiling.add_sections(sections)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
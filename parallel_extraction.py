@@ -0,0 +1,52 @@
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+import log_config
+import profiling
+
+# Row-parallel feature extraction for FeatureExtractor (feature_extraction_parkinsons.py).
+# The features of a row only depend on that row, so each stage runs on partitions of the
+# data frame in a process pool, and the partitions are concatenated back in row order. The
+# pool is forked after the extractor has opened its language model, whose arrays are
+# memory-mapped, so the workers share its pages instead of loading the model again.
+# Each partition comes back with the cache stats of its worker and the profiling sections it
+# ran, so that the profiling report covers the lookups and sections of all processes.
+
+PARTITIONS_PER_WORKER = 4  # more partitions than workers, so that a slow partition doesn't hold up the rest
+
+worker_extractor = None
+
+
+def init_worker(extractor):
+    global worker_extractor
+    log_config.after_fork()
+    profiling.after_fork()
+    # the counters copied from the parent are already in its own stats
+    extractor.reset_cache_stats()
+    worker_extractor = extractor
+
+
+def extract_partition(task):
+    stage, df = task
+    result = getattr(worker_extractor, stage)(df)
+    return os.getpid(), result, worker_extractor.process_cache_stats(), profiling.take_sections()
+
+
+def start_pool(extractor, workers):
+    return multiprocessing.Pool(workers, init_worker, (extractor,))
+
+
+def run_stage(pool, workers, stage, df, worker_stats, partitions_per_worker=PARTITIONS_PER_WORKER):
+    # worker_stats maps the process id of each worker to its latest cache stats
+    bounds = np.linspace(0, len(df), workers * partitions_per_worker + 1).astype(int)
+    tasks = [(stage, df.iloc[start:end]) for start, end in zip(bounds[:-1], bounds[1:]) if end > start] or [(stage, df)]
+    results = []
+    for pid, result, stats, sections in pool.map(extract_partition, tasks, 1):
+        results.append(result)
+        # a worker takes its partitions in order and its stats only grow, so the last ones cover all of them
+        worker_stats[pid] = stats
+        profiling.add_sections(sections)
+    # partitions that lost all their rows would turn the type of every column into object
+    results = [result for result in results if len(result)] or results[:1]
+    return pd.concat(results)
@@ -0,0 +1,204 @@
+from __future__ import division
+import json
+import os
+import resource
+import sys
+import time
+from collections import OrderedDict
+
+# Optional instrumentation of ErrorAligner.parse_errors and FeatureExtractor.extract_features.
+# Code is wrapped in named sections (with profiling.section('ngram', len(df)): ...), which
+# record wall time, CPU time, rows and the change in resident memory, summed over all calls of
+# the same section. Sections nest, so a feature column shows up under its stage. Until enable()
+# installs a Profiler, section() returns a shared no-op, so the hooks cost next to nothing.
+# Worker processes (--workers) send the totals of their sections back with their results
+# (take_sections), and the parent adds them under the section it runs the workers in
+# (add_sections), so their wall times are summed over the workers.
+
+profiler = None
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = None
+
+
+def enable():
+    global profiler
+    if profiler is None:
+        profiler = Profiler()
+    return profiler
+
+
+def disable():
+    global profiler
+    profiler = None
+
+
+def write_report(json_file=None, caches=None):
+    # prints the summary table, and writes the JSON report to json_file if it is given
+    if profiler is None:
+        return
+    if caches:
+        profiler.set_caches(caches)
+    print(profiler.table())
+    if json_file:
+        profiler.write_json(json_file)
+
+
+def after_fork():
+    # the sections of the parent are in its own report, a worker only reports its own ones
+    if profiler is not None:
+        profiler.sections = OrderedDict()
+        profiler.stack = []
+
+
+def take_sections():
+    # totals of the sections since the last call, to send from a worker process to the parent
+    if profiler is None:
+        return None
+    sections = profiler.sections
+    profiler.sections = OrderedDict()
+    return sections
+
+
+def add_sections(sections):
+    # adds the section totals of a worker process under the sections that are open in this one
+    if profiler is None or not sections:
+        return
+    for key, totals in sections.items():
+        profiler.merge('/'.join(profiler.stack + [key]), totals)
+
+
+def merge_stats(stats):
+    """
+    Sums cache stats of several processes (dicts like the ones of LRUCache.stats), key by key
+    and into nested dicts; max_size is the largest one and hit_rate is recomputed.
+    """
+    merged = {}
+    for process_stats in stats:
+        for key, value in process_stats.items():
+            if isinstance(value, dict):
+                merged[key] = merge_stats([merged.get(key, {}), value])
+            elif key == 'max_size':
+                merged[key] = max(merged.get(key, value), value)
+            elif key != 'hit_rate':
+                merged[key] = merged.get(key, 0) + value
+    if 'hits' in merged and any('hit_rate' in process_stats for process_stats in stats):
+        lookups = merged['hits'] + merged.get('misses', 0)
+        merged['hit_rate'] = merged['hits'] / lookups if lookups else 0.0
+    return merged
+
+
+def section(name, rows=None):
+    if profiler is None:
+        return NO_SECTION
+    return Section(profiler, name, rows)
+
+
+def memory_mb():
+    # resident memory of the process, or its peak where /proc isn't available
+    if PAGE_SIZE is not None:
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * PAGE_SIZE / (1024 * 1024)
+        except (IOError, IndexError, ValueError):
+            pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def cpu_seconds():
+    user, system = os.times()[:2]
+    return user + system
+
+
+class NoSection:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NO_SECTION = NoSection()
+
+
+class Section:
+    def __init__(self, profiler, name, rows):
+        self.profiler = profiler
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self.profiler.stack.append(self.name)
+        self.key = '/'.join(self.profiler.stack)
+        self.memory = memory_mb()
+        self.cpu = cpu_seconds()
+        self.wall = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.time() - self.wall
+        cpu = cpu_seconds() - self.cpu
+        self.profiler.add(self.key, self.rows, wall, cpu, memory_mb() - self.memory)
+        self.profiler.stack.pop()
+        return False
+
+
+class Profiler:
+    """
+      Totals of every section, in the order the sections were first entered, plus the hit and
+      miss counts of the lookup caches, which the instrumented code hands to set_caches.
+    """
+
+    def __init__(self):
+        self.sections = OrderedDict()
+        self.stack = []
+        self.caches = {}
+
+    def add(self, key, rows, wall, cpu, memory):
+        self.merge(key, {'calls': 1, 'rows': rows, 'wall_seconds': wall, 'cpu_seconds': cpu, 'memory_mb': memory})
+
+    def merge(self, key, section_totals):
+        totals = self.sections.get(key)
+        if totals is None:
+            totals = self.sections[key] = {'calls': 0, 'rows': None, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                           'memory_mb': 0.0}
+        totals['calls'] += section_totals['calls']
+        if section_totals['rows'] is not None:
+            totals['rows'] = (totals['rows'] or 0) + section_totals['rows']
+        totals['wall_seconds'] += section_totals['wall_seconds']
+        totals['cpu_seconds'] += section_totals['cpu_seconds']
+        totals['memory_mb'] += section_totals['memory_mb']
+
+    def set_caches(self, caches):
+        self.caches.update(caches)
+
+    def report(self):
+        sections = []
+        for key, totals in self.sections.items():
+            record = dict(totals, section=key)
+            seconds = totals['wall_seconds']
+            record['rows_per_second'] = totals['rows'] / seconds if totals['rows'] is not None and seconds else None
+            sections.append(record)
+        return {'sections': sections, 'caches': self.caches}
+
+    def write_json(self, file_name):
+        with open(file_name, 'w') as f:
+            json.dump(self.report(), f, indent=1, sort_keys=True)
+
+    def table(self):
+        report = self.report()
+        width = max([len(record['section']) for record in report['sections']] + [len('section')])
+        lines = ['%-*s %7s %9s %10s %10s %11s %11s' % (width, 'section', 'calls', 'rows', 'wall s', 'cpu s',
+                                                       'rows/s', 'memory MB')]
+        for record in report['sections']:
+            lines.append('%-*s %7d %9s %10.3f %10.3f %11s %+11.1f' % (
+                width, record['section'], record['calls'], '' if record['rows'] is None else record['rows'],
+                record['wall_seconds'], record['cpu_seconds'],
+                '' if record['rows_per_second'] is None else '%.0f' % record['rows_per_second'],
+                record['memory_mb']))
+        for name, stats in sorted(report['caches'].items()):
+            lines.append(name + ': ' + ', '.join('%s=%s' % item for item in sorted(stats.items())))
+        return '\n'.join(lines)
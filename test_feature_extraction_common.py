@@ -0,0 +1,213 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+import log_config
+from feature_extraction_common import CONTEXT_OFFSET, FeatureExtractionCommon, edit_distance_cache
+
+# The column-wise functions of FeatureExtractionCommon have to give what the row by row
+# functions of the original feature extraction give, on seeded random rows.
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data')
+LETTERS = u'abcde\xe9'
+
+
+def typed_version(intended, rand):
+    # intended with one substitution, insertion or omission, or cut short
+    index = rand.randint(0, len(intended))
+    kind = rand.randint(0, 3)
+    if kind == 0:
+        return intended[:index] + rand.choice(LETTERS) + intended[index + 1:]
+    elif kind == 1:
+        return intended[:index] + u''.join(rand.choice(LETTERS) for _ in range(rand.randint(1, 3))) + intended[index:]
+    elif kind == 2:
+        return intended[:index] + intended[index + 1:]
+    return intended[:index]
+
+
+def error_rows(count, seed=1):
+    # rows of a base stage: the error word in its context, and where the error starts
+    rand = random.Random(seed)
+    rows = []
+    while len(rows) < count:
+        words = [u''.join(rand.choice(LETTERS) for _ in range(rand.randint(1, 6))) for _ in range(rand.randint(1, 6))]
+        word = rand.randrange(len(words))
+        intended = words[word]
+        typed = typed_version(intended, rand)
+        if typed == intended or typed == u'':
+            continue
+        error_start = FeatureExtractionCommon.error_index(typed, intended)
+        context = u' '.join(words[:word] + [typed] + words[word + 1:]) + rand.choice([u'', u'.'])
+        position = len(u' '.join(words[:word])) + (1 if word else 0)
+        if rand.random() < 0.1:
+            # only part of the context, which can end before the word
+            context = context[:rand.randint(0, position + len(typed))]
+        rows.append((len(rows), typed, intended, error_start, error_start, max(len(typed) - 1, error_start),
+                     max(len(intended) - 1, error_start), context, position))
+    return pd.DataFrame(rows, columns=['ID', 'Typed', 'Intended', 'error_start_typed', 'error_start_intended',
+                                       'error_end_typed', 'error_end_intended', 'Error Context', 'Position of word'])
+
+
+def raw_strings(count, rand, max_length=14):
+    # keystrokes with backspaces ('*') and spaces ('}'), also in runs
+    return [u''.join(rand.choice(u'ab\xe9**}') for _ in range(rand.randint(0, max_length))) for _ in range(count)]
+
+
+class ExtractorTest(unittest.TestCase):
+    # with a FeatureExtractionCommon of the test language model
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp(prefix='test_feature_extraction_common')
+        log_config.set_log_directory(cls.work_dir)
+        lm_file = os.path.join(cls.work_dir, 'chars_english.lm')
+        shutil.copy(os.path.join(TEST_DATA, 'chars_english.lm'), lm_file)
+        cls.fe = FeatureExtractionCommon(lm_file, 'english')
+
+    @classmethod
+    def tearDownClass(cls):
+        log_config.set_log_directory(None)
+        shutil.rmtree(cls.work_dir)
+
+
+class ErrorContextTest(ExtractorTest):
+    @classmethod
+    def setUpClass(cls):
+        super(ErrorContextTest, cls).setUpClass()
+        cls.df = error_rows(300)
+
+    def check_contexts(self, contexts):
+        fe = self.fe
+        for index, row in self.df.iterrows():
+            for word, text, error_start in (('typed', row.Typed, row.error_start_typed),
+                                            ('intended', row.Intended, row.error_start_intended)):
+                mistyped, chars = contexts[word][0][index], contexts[word][1][index]
+                self.assertEqual(mistyped, fe.get_mistyped_char(text, error_start))
+                self.assertEqual(chars[CONTEXT_OFFSET], fe.get_mistyped_char_and_before(row, text, error_start)[0])
+                for offset in range(1, CONTEXT_OFFSET + 1):
+                    self.assertEqual(chars[CONTEXT_OFFSET - offset],
+                                     fe.get_mistyped_char_and_before(row, text, error_start, offset)[1], dict(row))
+                    self.assertEqual(chars[CONTEXT_OFFSET + offset],
+                                     fe.get_mistyped_char_and_after(row, text, error_start, offset)[1], dict(row))
+
+    def check_features(self, contexts):
+        rows = [row for _, row in self.df.iterrows()]
+        for feature, values in self.fe.keyboard_distance_features(contexts) + self.fe.ngram_features(contexts):
+            self.assertEqual(list(values), [getattr(self.fe, feature)(row) for row in rows], feature)
+
+    def test_error_contexts(self):
+        contexts = self.fe.error_contexts(self.df)
+        self.check_contexts(contexts)
+        self.check_features(contexts)
+
+    def test_error_contexts_by_row(self):
+        contexts = self.fe.error_contexts_by_row(self.df)
+        self.check_contexts(contexts)
+        self.check_features(contexts)
+
+
+class BackspaceTest(unittest.TestCase):
+    def test_typed_words(self):
+        words = raw_strings(2000, random.Random(2), 8)
+        self.assertEqual(FeatureExtractionCommon.typed_words(words),
+                         [FeatureExtractionCommon.typed_word(word) for word in words])
+
+    def test_clean_typed_contexts(self):
+        rand = random.Random(3)
+        for _ in range(300):
+            # rows share their sentences, with positions in and around them
+            sentences = raw_strings(rand.randint(1, 4), rand)
+            raw_contexts = [rand.choice(sentences) for _ in range(rand.randint(1, 12))]
+            orig_indices = [rand.randint(-2, len(raw_context) + 2) for raw_context in raw_contexts]
+            expected = [FeatureExtractionCommon.clean_typed_context(raw_context, orig_index)
+                        for raw_context, orig_index in zip(raw_contexts, orig_indices)]
+            contexts, positions = FeatureExtractionCommon.clean_typed_contexts(raw_contexts, orig_indices)
+            self.assertEqual(zip(contexts, positions), expected, (raw_contexts, orig_indices))
+            self.assertEqual([type(position) for position in positions], [type(index) for _, index in expected])
+
+    def test_missing_positions(self):
+        raw_contexts = [u'ab*c}d', u'ab*c}d', u'a**bc']
+        orig_indices = [3, None, 1]
+        expected = [FeatureExtractionCommon.clean_typed_context(raw_context, orig_index)
+                    for raw_context, orig_index in zip(raw_contexts, orig_indices)]
+        self.assertEqual(zip(*FeatureExtractionCommon.clean_typed_contexts(raw_contexts, orig_indices)), expected)
+
+
+class ErrorLocationTest(unittest.TestCase):
+    def setUp(self):
+        edit_distance_cache.clear()
+
+    def tearDown(self):
+        edit_distance_cache.clear()
+
+    def test_error_locations(self):
+        rand = random.Random(4)
+        # few distinct words, so that pairs and their suffixes recur
+        words = [u''.join(rand.choice(u'abc') for _ in range(rand.randint(0, 6))) for _ in range(15)]
+        typed = [rand.choice(words) for _ in range(1000)]
+        intended = [rand.choice(words) for _ in typed]
+        expected = []
+        for typed_word, intended_word in zip(typed, intended):
+            error_start = FeatureExtractionCommon.error_index(typed_word, intended_word)
+            row = pd.Series({'Typed': typed_word, 'Intended': intended_word, 'error_start_typed': error_start,
+                             'error_start_intended': error_start})
+            expected.append((error_start, FeatureExtractionCommon.error_end_typed(row),
+                             FeatureExtractionCommon.error_end_intended(row), FeatureExtractionCommon.get_edit_distance(row)))
+        self.assertEqual(zip(*FeatureExtractionCommon.error_locations(typed, intended)), expected)
+        # again from the memoized edit distances
+        hits = edit_distance_cache.hits
+        self.assertEqual(zip(*FeatureExtractionCommon.error_locations(typed, intended)), expected)
+        self.assertTrue(edit_distance_cache.hits > hits)
+
+    def test_no_rows(self):
+        self.assertEqual(list(FeatureExtractionCommon.error_locations([], [])), [[], [], [], []])
+
+
+class MisalignedSequenceTest(ExtractorTest):
+    def length_misaligned_sequence(self, row):
+        # the original implementation, one loop after the other, with the operation of the loop that matched
+        fe = self.fe
+        mistyped_typed = fe.get_mistyped_char(row.Typed, row.error_start_typed)
+        mistyped_intended = fe.get_mistyped_char(row.Intended, row.error_start_intended)
+        length_after_typed = len(row.Typed[row.error_start_typed:row.error_end_typed])
+        length_after_intended = len(row.Intended[row.error_start_intended:row.error_end_intended])
+        typed_offsets = range(1, 2 + row.error_end_typed - row.error_start_typed)
+        intended_offsets = range(1, 2 + row.error_end_intended - row.error_start_intended)
+
+        def next_typed(offset):
+            return fe.get_mistyped_char_and_after(row, row.Typed, row.error_start_typed, offset)[1]
+
+        def next_intended(offset):
+            return fe.get_mistyped_char_and_after(row, row.Intended, row.error_start_intended, offset)[1]
+
+        if length_after_typed == length_after_intended:
+            for offset in typed_offsets:
+                if next_typed(offset) == next_intended(offset):
+                    return offset, offset, 'substitution'
+            for offset in typed_offsets:
+                if next_typed(offset) == mistyped_intended:
+                    return offset, 0, 'migration'
+            for offset in intended_offsets:
+                if mistyped_typed == next_intended(offset):
+                    return 0, offset, 'deletion'
+        elif length_after_typed > length_after_intended:
+            for offset in typed_offsets:
+                if next_typed(offset) == mistyped_intended:
+                    return offset, 0, 'insertion'
+        else:
+            for offset in intended_offsets:
+                if mistyped_typed == next_intended(offset):
+                    return 0, offset, 'deletion'
+        return len(typed_offsets), len(intended_offsets), 'combination'
+
+    def test_misaligned_sequences(self):
+        df = error_rows(2000, seed=5)
+        expected = [self.length_misaligned_sequence(row) for _, row in df.iterrows()]
+        self.assertEqual(zip(*self.fe.misaligned_sequences(df)), expected)
+        self.assertEqual(set(operation for _, _, operation in expected),
+                         set(['substitution', 'migration', 'insertion', 'deletion', 'combination']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import log_config
+from feature_extraction_parkinsons import FeatureExtractor
+
+# test_data/baseline_features.csv was written by the feature extraction as it was before the
+# features were vectorized, from errors_english.txt and chars_english.lm, which were made with
+# benchmark.generate_keystrokes(participants=2, sentences=6) and the alignment. The output has
+# to stay the same to the byte: n-grams of the model as the text of the ARPA file ('0', not '0.0'),
+# backed-off probabilities as floats and NA where no n-gram is found.
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data')
+
+
+class BaselineOutputTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='test_feature_extraction')
+        log_config.set_log_directory(self.work_dir)
+        for name in ('errors_english.txt', 'chars_english.lm'):
+            shutil.copy(os.path.join(TEST_DATA, name), self.work_dir)
+        with io.open(os.path.join(TEST_DATA, 'baseline_features.csv'), encoding='utf-8') as f:
+            self.baseline = f.read()
+
+    def tearDown(self):
+        log_config.set_log_directory(None)
+        shutil.rmtree(self.work_dir)
+
+    def extract(self, workers):
+        output_file = os.path.join(self.work_dir, 'features%d.csv' % workers)
+        FeatureExtractor('english', os.path.join(self.work_dir, 'errors_english.txt'), output_file,
+                         os.path.join(self.work_dir, 'features%d' % workers),
+                         os.path.join(self.work_dir, 'chars_english.lm'), workers=workers).run_extractor()
+        with io.open(output_file, encoding='utf-8') as f:
+            return f.read()
+
+    def test_same_output(self):
+        self.assertEqual(self.extract(1), self.baseline)
+
+    def test_same_output_with_workers(self):
+        self.assertEqual(self.extract(2), self.baseline)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from language_model import CharLanguageModel
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data')
+
+
+class CompactModelTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='test_language_model')
+        self.lm_file = os.path.join(self.work_dir, 'chars.lm')
+        shutil.copy(os.path.join(TEST_DATA, 'chars_english.lm'), self.lm_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def log_prob(self, string_lm):
+        model = CharLanguageModel.open(self.lm_file)
+        order = len(string_lm.split(' '))
+        return model.log_prob_text(order, model.lookup(string_lm, order))
+
+    def test_replaced_arpa_file(self):
+        self.assertEqual(self.log_prob(u'<s>'), '-1.605664')
+        # a replaced ARPA file can be older than the compact model converted from the old one
+        with io.open(self.lm_file, encoding='utf-8') as f:
+            text = f.read()
+        with io.open(self.lm_file, 'w', encoding='utf-8') as f:
+            f.write(text.replace(u'-1.605664\t<s>', u'-1.5\t<s>'))
+        os.utime(self.lm_file, (0, 0))
+        self.assertEqual(self.log_prob(u'<s>'), '-1.5')
+        self.assertEqual(self.log_prob(u'<s>'), '-1.5')
+
+    def test_without_arpa_file(self):
+        self.log_prob(u'<s>')
+        os.remove(self.lm_file)
+        self.assertEqual(self.log_prob(u'<s>'), '-1.605664')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import random
+import unittest
+import needleman_wunsch
+
+# The numpy and banded engines have to give the alignments of align_python, which the
+# alignment output was made with. The banded engine only fills a band of cells when that
+# takes less memory than align_numpy.
+
+ALPHABET = u'abcde}^*'
+
+
+def typed_version(intended, rand, error_rate=0.1):
+    # intended with omissions, substitutions and insertions, some of them followed by backspaces
+    chars = []
+    for char in intended:
+        kind = rand.random()
+        if kind < error_rate / 3:
+            continue
+        elif kind < 2 * error_rate / 3:
+            chars.append(rand.choice(ALPHABET))
+        elif kind < error_rate:
+            chars.extend([rand.choice(ALPHABET), u'*', char])
+        else:
+            chars.append(char)
+    return u''.join(chars)
+
+
+def sentence_pairs(count, max_length, seed=1):
+    rand = random.Random(seed)
+    pairs = [(u'', u''), (u'a', u''), (u'', u'abc'), (u'abc', u'abc'), (u'^^a', u'a^^')]
+    for _ in range(count):
+        intended = u''.join(rand.choice(ALPHABET) for _ in range(rand.randint(0, max_length)))
+        typed = typed_version(intended, rand)
+        if rand.random() < 0.1:
+            # typed on past the end of the sentence
+            typed += u''.join(rand.choice(ALPHABET) for _ in range(rand.randint(1, max_length)))
+        pairs.append((typed, intended))
+    return pairs
+
+
+class EngineTest(unittest.TestCase):
+    def test_numpy_engine(self):
+        for typed, intended in sentence_pairs(300, 40):
+            self.assertEqual(needleman_wunsch.align_numpy(typed, intended),
+                             needleman_wunsch.align_python(typed, intended), (typed, intended))
+
+    def test_gap_penalties(self):
+        for gap_penalty in (-1, -3):
+            for typed, intended in sentence_pairs(50, 30, seed=2):
+                expected = needleman_wunsch.align_python(typed, intended, gap_penalty)
+                self.assertEqual(needleman_wunsch.align_numpy(typed, intended, gap_penalty), expected)
+                self.assertEqual(needleman_wunsch.align_banded(typed, intended, gap_penalty), expected)
+
+    def test_long_sentences(self):
+        for typed, intended in sentence_pairs(10, 300, seed=3):
+            expected = needleman_wunsch.align_python(typed, intended)
+            for engine in sorted(needleman_wunsch.ENGINES):
+                self.assertEqual(needleman_wunsch.align(typed, intended, engine=engine), expected, engine)
+
+
+class BandedEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.passes = []
+        self.banded_scores = needleman_wunsch.banded_scores
+
+        def counting(seq1, seq2, gap_penalty, band):
+            self.passes.append(band)
+            return self.banded_scores(seq1, seq2, gap_penalty, band)
+        needleman_wunsch.banded_scores = counting
+
+    def tearDown(self):
+        needleman_wunsch.banded_scores = self.banded_scores
+
+    def test_narrow_bands(self):
+        # starting from narrow bands, so that most sentences need the band to be widened
+        for typed, intended in sentence_pairs(40, 300, seed=4):
+            expected = needleman_wunsch.align_python(typed, intended)
+            for band in (1, 2, 4, needleman_wunsch.BAND_WIDTH):
+                self.assertEqual(needleman_wunsch.align_banded(typed, intended, band=band), expected,
+                                 (typed, intended, band))
+        self.assertTrue(len(self.passes) > 40)
+
+    def test_numpy_fallback(self):
+        # the band would be at least as big as the pointers of align_numpy
+        rand = random.Random(5)
+        for typed_length, intended_length in [(600, 100), (80, 80), (10, 3)]:
+            typed = u''.join(rand.choice(ALPHABET) for _ in range(typed_length))
+            intended = u''.join(rand.choice(ALPHABET) for _ in range(intended_length))
+            band_size = needleman_wunsch.banded_size(typed_length, intended_length, needleman_wunsch.BAND_WIDTH)
+            self.assertTrue(band_size >= (typed_length + 1) * (intended_length + 1))
+            self.assertEqual(needleman_wunsch.align_banded(typed, intended),
+                             needleman_wunsch.align_numpy(typed, intended))
+        self.assertEqual(self.passes, [])
+
+    def test_long_similar_sentences(self):
+        rand = random.Random(6)
+        intended = u''.join(rand.choice(ALPHABET) for _ in range(400))
+        typed = typed_version(intended, rand, error_rate=0.02)
+        self.assertEqual(needleman_wunsch.align_banded(typed, intended), needleman_wunsch.align_python(typed, intended))
+        self.assertTrue(self.passes)
+        self.assertTrue(needleman_wunsch.banded_size(len(typed), len(intended), self.passes[-1]) <
+                        len(typed) * len(intended))
+
+
+if __name__ == '__main__':
+    unittest.main()
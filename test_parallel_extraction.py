@@ -0,0 +1,51 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import benchmark
+from alignment import ErrorAligner
+
+# Runs the extraction in a separate process, as the log files and the background log thread
+# are set up once per process.
+EXTRACT = '''
+import sys
+sys.path.insert(0, %r)
+import log_config
+from feature_extraction_parkinsons import FeatureExtractor
+log_config.enable_debug_logging(sys.argv[1] == 'async')
+FeatureExtractor('english', 'errors.txt', 'features.csv', 'features', 'chars.lm', True, 2).run_extractor()
+''' % os.path.dirname(os.path.abspath(__file__))
+
+
+class ParallelExtractionTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='test_parallel_extraction')
+        keystroke_file = os.path.join(self.work_dir, 'keystrokes.tsv')
+        _, texts = benchmark.generate_keystrokes(keystroke_file, participants=2, sentences=10)
+        benchmark.generate_language_model(os.path.join(self.work_dir, 'chars.lm'), texts)
+        ErrorAligner(keystroke_file, os.path.join(self.work_dir, 'errors.txt')).parse_errors()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def extract(self, logging_mode):
+        # lines of the log file the workers write to
+        log_file = os.path.join(self.work_dir, 'feature_extraction_common.log')
+        if os.path.exists(log_file):
+            os.remove(log_file)
+        shutil.rmtree(os.path.join(self.work_dir, 'features'), True)
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable, '-c', EXTRACT, logging_mode], cwd=self.work_dir, stdout=devnull)
+        with open(log_file) as f:
+            return sorted(f.readlines())
+
+    def test_async_logging_of_workers(self):
+        lines = self.extract('sync')
+        self.assertTrue(lines)
+        self.assertEqual(self.extract('async'), lines)
+
+
+if __name__ == '__main__':
+    unittest.main()